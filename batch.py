@@ -0,0 +1,210 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtGui import QGuiApplication
+from proekt import Document
+from catalog import natural_key, thumbnail_image
+from glyphs import load_any_script, LOAD_ERRORS
+import render
+
+
+EXPORT_FORMATS = ('gif', 'webp', 'png')
+
+worker_app = None
+
+
+def pattern_base(path):
+    # папка, от которой считаются пути найденных скриптов: сама папка
+    # или начало шаблона glob до первой части с *, ? или [
+    if os.path.isdir(path):
+        return path
+    parts = []
+    for part in os.path.dirname(path).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+
+def script_files(paths):
+    # Скрипты из папок (*.txt) и шаблонов glob по порядку, без повторов, каждый
+    # с путём для выгрузки: имя своей папки и путь внутри неё, как «examples/Пример 1.txt».
+    # Второй список - пути, под которые ничего не подошло
+    files, missing, roots = {}, [], {}
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, name) for name in os.listdir(path)
+                     if name.endswith('.txt') and os.path.isfile(os.path.join(path, name))]
+        else:
+            names = glob.glob(path)
+        if not names:
+            missing.append(path)
+        base = pattern_base(path)
+        key = os.path.abspath(base)
+        if key not in roots:
+            # разные папки с одинаковым именем не пишут в одну
+            root = unique = os.path.basename(key) if base else ''
+            number = 2
+            while unique in roots.values():
+                unique = f'{root} ({number})'
+                number += 1
+            roots[key] = unique
+        for name in sorted(names, key=natural_key):
+            name = os.path.normpath(name)
+            relative = os.path.relpath(os.path.abspath(name), key)
+            files.setdefault(name, os.path.join(roots[key], relative))
+    return list(files.items()), missing
+
+
+def output_path(settings, relative, suffix):
+    path = os.path.join(settings['output'], os.path.splitext(relative)[0] + suffix)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return path
+
+
+def timed(result, name, start):
+    result[name] = (time.perf_counter() - start) * 1000
+
+
+def process_script(task):
+    # Проверка, нормализованная копия, картинка и выгрузка одного скрипта.
+    # Любая ошибка на одном скрипте, и в самой программе тоже, не прерывает
+    # пакет, а попадает в отчёт
+    file_name, relative, settings = task
+    result = {'file': file_name}
+    try:
+        run_script(file_name, relative, settings, result)
+    except Exception as error:
+        result['error'] = f'{type(error).__name__}: {error}'
+    return result
+
+
+def run_script(file_name, relative, settings, result):
+    start = time.perf_counter()
+    try:
+        script = load_any_script(file_name, settings['cache'])
+    except LOAD_ERRORS as error:
+        result['error'] = str(error)
+        return
+    document = Document()
+    document.load_script(script)
+    timed(result, 'load_ms', start)
+    result.update(figures=len(document.store), anims=len(document.store.anim_kind),
+                  duration=document.duration)
+    try:
+        if settings['output']:
+            start = time.perf_counter()
+            with open(output_path(settings, relative, '.txt'), 'w', encoding='utf-8') as f:
+                document.save_file(f)
+            timed(result, 'normalize_ms', start)
+        if settings['thumbnails']:
+            start = time.perf_counter()
+            if not thumbnail_image(document).save(output_path(settings, relative, '.png'), 'PNG'):
+                raise OSError('не удалось записать картинку')
+            timed(result, 'thumbnail_ms', start)
+        if settings['export']:
+            start = time.perf_counter()
+            document.set_loops(settings['loops'])
+            suffix = '' if settings['export'] == 'png' else '.' + settings['export']
+            steps = render.timeline(document, every=settings['every'])
+            stats = render.export(document, steps, output_path(settings, relative, suffix),
+                                  settings['frame_duration'])
+            timed(result, 'export_ms', start)
+            result['export'] = str(stats)
+    except OSError as error:
+        result['error'] = str(error)
+
+
+def init_worker():
+    # каждый процесс создаёт приложение Qt один раз
+    global worker_app
+    worker_app = QGuiApplication(sys.argv[:1])
+
+
+def run_batch(tasks, workers):
+    # результаты по мере готовности, в каком порядке закончились скрипты
+    if workers <= 1:
+        yield from map(process_script, tasks)
+        return
+    # spawn, а не fork: Qt в родительском процессе уже запущен
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, init_worker) as pool:
+        yield from pool.imap_unordered(process_script, tasks)
+
+
+def print_result(result):
+    times = ''.join(f'{result[name]:9.1f}' if name in result else f'{"-":>9}'
+                    for name in ('load_ms', 'normalize_ms', 'thumbnail_ms', 'export_ms'))
+    name = os.path.relpath(result['file'])
+    if 'error' in result:
+        print(f'{name:32} {"":>7}{times}  ошибка: {result["error"]}')
+    else:
+        print(f'{name:32} {result["figures"]:7}{times}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Проверка, нормализация и отрисовка '
+                                                 'многих скриптов анимации')
+    parser.add_argument('paths', nargs='+', help='папки со скриптами или шаблоны, '
+                                                 'например examples letters "gen/*.txt"')
+    parser.add_argument('--output', '-o', help='папка для нормализованных скриптов, картинок '
+                                               'и выгрузок; без неё скрипты только проверяются')
+    parser.add_argument('--thumbnails', action='store_true',
+                        help='картинка кадра после разовых анимаций, как в окне «Примеры»')
+    parser.add_argument('--export', choices=EXPORT_FORMATS,
+                        help='выгрузить каждый скрипт целиком: GIF, WebP или папка PNG')
+    parser.add_argument('--every', type=float, default=1, help='брать каждый N-й кадр')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='сколько раз повторить циклические анимации')
+    parser.add_argument('--frame-duration', type=int, default=40,
+                        help='длительность кадра в GIF/WebP, мс')
+    parser.add_argument('--cache', action='store_true',
+                        help='читать и писать двоичные копии *.anim.bin')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='число процессов (0 - по числу ядер)')
+    parser.add_argument('--report', help='отчёт в JSON')
+    args = parser.parse_args(argv)
+    if (args.thumbnails or args.export) and not args.output:
+        parser.error('для картинок и выгрузки нужна папка --output')
+    if args.every <= 0:
+        parser.error('шаг между кадрами должен быть больше нуля')
+
+    app = QGuiApplication(sys.argv[:1])
+    files, missing = script_files(args.paths)
+    settings = {'output': args.output, 'thumbnails': args.thumbnails, 'export': args.export,
+                'every': args.every, 'loops': max(args.loops, 1),
+                'frame_duration': args.frame_duration, 'cache': args.cache}
+    tasks = [(name, relative, settings) for name, relative in files]
+    workers = min(args.workers or os.cpu_count(), max(len(tasks), 1))
+
+    results = [{'file': path, 'error': 'нет таких скриптов'} for path in missing]
+    print(f'Скриптов: {len(tasks)}, процессов: {workers}')
+    print(f'{"Скрипт":32} {"фигур":>7}{"загр. мс":>9}{"норм. мс":>9}{"карт. мс":>9}'
+          f'{"выгр. мс":>9}')
+    for result in results:
+        print_result(result)
+    start = time.perf_counter()
+    for result in run_batch(tasks, workers):
+        print_result(result)
+        results.append(result)
+    elapsed = time.perf_counter() - start
+
+    errors = sum('error' in result for result in results)
+    print(f'Готово: {len(results) - errors}, с ошибками: {errors}, за {elapsed:.2f} с')
+    if args.report:
+        results.sort(key=lambda result: natural_key(result['file']))
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'workers': workers, 'elapsed_s': elapsed,
+                       'errors': errors, 'files': results}, f, ensure_ascii=False, indent=1)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
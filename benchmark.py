@@ -0,0 +1,521 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QApplication
+import glyphs
+import glcanvas
+import proekt
+import render
+import script_parser
+
+
+FRAMES = 200
+STEP_STRIDE = 37
+SUITE_VERSION = 2
+# Метрики набора замеров (все - чем меньше, тем лучше) и порог шума для каждой:
+# разница меньше порога не считается регрессией, как бы велика она ни была в долях.
+# Времена - медианы из нескольких повторов, их разброс тоже учитывается
+SUITE_METRICS = {'load_ms': 0.5, 'draw_ms': 0.5, 'render_ms': 0.5, 'peak_mib': 1.0}
+NOISE_SPREAD = 3  # во сколько раз разница должна превышать разброс повторов
+# запуск программы, как в proekt.py, с отметками времени первой отрисовки окна
+# и первого кадра с загруженным примером
+STARTUP_SCRIPT = '''
+import sys, time
+from PyQt5.QtWidgets import QApplication
+import proekt
+proekt.COMPILED_UI = {compiled}
+app = QApplication(sys.argv[:1])
+form = proekt.Form()
+form.setFixedSize(1025, 800)
+painted = form.frame_painted
+first = []
+
+def frame_painted():
+    painted()
+    if not first:
+        first.append(time.time())
+    if form.document.figuresCount:
+        print(first[0], time.time(), flush=True)
+        app.quit()
+
+form.frame_painted = frame_painted
+form.show()
+form.open_file(proekt.EXAMPLES_PATH + 'Пример 1.txt')
+app.exec()
+'''
+
+
+def example_files():
+    files = filter(lambda x: x.endswith('.txt'), os.listdir(proekt.EXAMPLES_PATH))
+    names = sorted(files, key=lambda s: int((s.split('.')[0]).split()[1]))
+    return [proekt.EXAMPLES_PATH + name for name in names]
+
+
+def bench_draw(form, file_name):
+    # среднее время отрисовки одного кадра (мс) на разных шагах анимации
+    form.open_file(file_name, background=False)
+    document = form.document
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        document.set_step(i * STEP_STRIDE)
+        form.widget.grab()
+    return (time.perf_counter() - start) / FRAMES * 1000
+
+
+def run_draw(args):
+    proekt.form = form = proekt.Form()
+    form.show()
+    print(f'{"Скрипт":24} {"Фигур":>6} {"мс/кадр":>8}')
+    for file_name in example_files():
+        ms = bench_draw(form, file_name)
+        print(f'{os.path.basename(file_name):24} {len(form.document.figures):6} {ms:8.3f}')
+
+
+def bench_export(file_name, frames, workers):
+    # кадров в секунду при выгрузке PNG-последовательности
+    document = render.load_document(file_name)
+    steps = render.timeline(document, end=frames)
+    with tempfile.TemporaryDirectory() as output:
+        start = time.perf_counter()
+        if workers > 1:
+            stats = render.export_parallel(file_name, steps, output, workers)
+        else:
+            stats = render.export(document, steps, output)
+        return stats.frames / (time.perf_counter() - start)
+
+
+def run_export(args):
+    print(f'Ядер: {os.cpu_count()}')
+    print(f'{"Скрипт":24}' + ''.join(f'{f"{w} проц.":>16}' for w in args.workers))
+    for file_name in example_files():
+        results = [bench_export(file_name, args.frames, w) for w in args.workers]
+        row = ''.join(f'{fps:8.1f} к/с x{fps / results[0]:4.2f}' for fps in results)
+        print(f'{os.path.basename(file_name):24}{row}')
+
+
+def synthetic_script(count, seed=0):
+    # случайная сцена: все типы фигур и анимаций, часть анимаций циклические
+    rnd = random.Random(seed)
+    colors = ['black', 'red', 'green', 'blue', 'orange', 'purple']
+    lines = ['800 600', str(count)]
+    for i in range(count):
+        x, y, size = rnd.uniform(0, 800), rnd.uniform(0, 600), rnd.uniform(4, 40)
+        kind = rnd.randrange(3)
+        if kind == 0:
+            lines.append(f'rectangle {x} {y} {size} {size / 2} 0.0 {rnd.choice(colors)}')
+        elif kind == 1:
+            lines.append(f'circle {x} {y} {size} {rnd.choice(colors)}')
+        else:
+            lines.append(f'triangle {x} {y} {size} 0.0 {rnd.choice(colors)}')
+        anims = []
+        for j in range(rnd.randrange(3)):
+            time = rnd.choice([500, 1000, 2000])
+            cycle = rnd.choice(['', 'cycle'])
+            anim = rnd.randrange(3)
+            if anim == 0:
+                anims.append(f'move {rnd.uniform(0, 800)} {rnd.uniform(0, 600)} {time} {cycle}')
+            elif anim == 1:
+                anims.append(f'rotate {rnd.uniform(-360, 360)} {time} {cycle}')
+            else:
+                anims.append(f'scale {rnd.uniform(0.5, 2)} {time} {cycle}')
+        lines.append(str(len(anims)))
+        lines.extend(anims)
+    return '\n'.join(lines) + '\n'
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_load(file_name):
+    # разбор текста, запись и чтение кэша *.anim.bin и сборка Document (мс)
+    with open(file_name, 'r', encoding='utf-8') as f:
+        text = f.read()
+    script, parse_ms = timed(script_parser.parse_script, text)
+    _, save_ms = timed(script_parser.save_cache, script, file_name)
+    _, cache_ms = timed(script_parser.load_cache, file_name)
+    _, build_ms = timed(proekt.Document().load_script, script)
+    os.remove(script_parser.cache_name(file_name))
+    return len(script.figures), parse_ms, save_ms, cache_ms, build_ms
+
+
+def run_load(args):
+    print(f'{"Скрипт":24} {"Фигур":>7} {"разбор":>9} {"запись":>9} {"кэш":>9} {"Document":>9}')
+    with tempfile.TemporaryDirectory() as folder:
+        files = []
+        for file_name in example_files():
+            copy = os.path.join(folder, os.path.basename(file_name))
+            with open(file_name, 'r', encoding='utf-8') as src, \
+                    open(copy, 'w', encoding='utf-8') as dst:
+                dst.write(src.read())
+            files.append(copy)
+        for count in args.figures:
+            file_name = os.path.join(folder, f'synthetic {count}.txt')
+            with open(file_name, 'w', encoding='utf-8') as f:
+                f.write(synthetic_script(count))
+            files.append(file_name)
+        for file_name in files:
+            figures, *times = bench_load(file_name)
+            row = ''.join(f'{ms:9.2f}' for ms in times)
+            print(f'{os.path.basename(file_name):24} {figures:7} {row}')
+
+
+def bench_edit(count, repeat):
+    # Правка одной фигуры против перезагрузки всей сцены (мс, медиана из repeat).
+    # В обоих случаях до готовности к следующему кадру: статичный слой и состояние
+    # сцены на текущем шаге; рисование самих фигур одинаково и не считается
+    document = proekt.Document()
+    document.load_script(script_parser.parse_script(synthetic_script(count)))
+    for step in range(0, 2000, 250):
+        document.render_image(step)
+    document.set_step(600)
+    text = document.save_text()
+
+    def ready(target):
+        target.get_static_layer()
+        target.frame_state(target.step)
+
+    def reload():
+        fresh = proekt.Document()
+        fresh.load_script(script_parser.parse_script(text))
+        fresh.set_step(600)
+        ready(fresh)
+
+    static = int(np.flatnonzero(document.store.anim_count == 0)[0])
+    animated = int(np.flatnonzero(document.store.anim_count > 0)[0])
+    edits = [
+        ('фигура+', lambda: document.add_figure('circle', 400, 300, 20, color='red')),
+        ('свойство', lambda: document.change_figure(static, x=100, color='blue')),
+        ('анимация+', lambda: document.add_anim(animated, 'rotate', 90, 3000, cycle=True)),
+        ('анимация-', lambda: document.remove_anim(animated, -1 + int(
+            document.store.anim_count[animated]))),
+        ('фигура-', lambda: document.remove_figure(len(document.store) - 1)),
+    ]
+    results = [('перезагрузка', statistics.median(timed(reload)[1] for _ in range(repeat)))]
+    for name, edit in edits:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            edit()
+            ready(document)
+            times.append((time.perf_counter() - start) * 1000)
+        results.append((name, statistics.median(times)))
+    return results
+
+
+def run_edit(args):
+    for count in args.figures:
+        results = bench_edit(count, args.repeat)
+        if count == args.figures[0]:
+            print(f'{"Фигур":>7}' + ''.join(f'{name:>14}' for name, ms in results))
+        print(f'{count:7}' + ''.join(f'{ms:14.1f}' for name, ms in results))
+
+
+def run_memory(args):
+    # память, которую занимает загруженный Document на синтетических сценах
+    print(f'{"Фигур":>7} {"МиБ":>8} {"пик МиБ":>8} {"байт/фиг.":>10} {"массивы МиБ":>12}')
+    for count in args.figures:
+        script = script_parser.parse_script(synthetic_script(count))
+        tracemalloc.start()
+        document = proekt.Document()
+        document.load_script(script)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        arrays = document.store.nbytes()
+        print(f'{count:7} {current / 2 ** 20:8.1f} {peak / 2 ** 20:8.1f} {current / count:10.0f} '
+              f'{arrays / 2 ** 20:12.1f}')
+        del document
+
+
+def suite_files():
+    # скрипты examples/ и буквы letters/ в одном порядке на любой машине
+    letters = sorted(os.path.join(glyphs.LETTERS_PATH, name)
+                     for name in os.listdir(glyphs.LETTERS_PATH) if name.endswith('.txt'))
+    return example_files() + letters
+
+
+def load_case(file_name):
+    # Document из файла и время загрузки (мс). Буквы в коротком формате
+    # («R x y ...») Document.load_file не разбирает, их читает glyphs
+    document = proekt.Document()
+    start = time.perf_counter()
+    if glyphs.is_compact(file_name):
+        document.load_script(glyphs.glyph_script(file_name))
+    else:
+        with open(file_name, 'r', encoding='utf-8') as f:
+            document.load_file(f)
+    return document, (time.perf_counter() - start) * 1000
+
+
+def case_steps(document, frames):
+    # шаги, равномерно покрывающие всю шкалу времени документа
+    every = max(1, document.duration // frames)
+    return range(0, document.duration, every)[:frames]
+
+
+def repeated(function, repeat):
+    # медиана и разброс (медиана отклонений от неё) времени из repeat повторов, мс;
+    # сборка мусора не должна попадать в случайный повтор
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            times.append(function())
+        finally:
+            gc.enable()
+    median = statistics.median(times)
+    return median, statistics.median(abs(ms - median) for ms in times)
+
+
+def bench_case(file_name, args):
+    # Один документ: загрузка, кадр Document.draw на шагах по всей шкале
+    # (среднее за проход), кадр render_image на args.render_frames шагах
+    # по шкале без записи на диск - медианы из args.repeat повторов; пиковая
+    # память Python и numpy при загрузке и первом кадре
+    load_ms, load_spread = repeated(lambda: load_case(file_name)[1], args.repeat)
+    document, _ = load_case(file_name)
+    # Document.draw рисует в картинку вместо виджета: без окна и кэша кадров
+    target = QImage(document.width, document.height, QImage.Format_ARGB32_Premultiplied)
+    document.widget = target
+    document.draw()
+    draw_steps = case_steps(document, args.frames)
+    render_steps = case_steps(document, args.render_frames)
+
+    def draw_pass():
+        total = 0
+        for step in draw_steps:
+            document.set_step(step)
+            target.fill(0xffffffff)
+            start = time.perf_counter()
+            document.draw()
+            total += time.perf_counter() - start
+        return total / len(draw_steps) * 1000
+
+    def render_pass():
+        start = time.perf_counter()
+        for _ in render.render_frames(document, render_steps):
+            pass
+        return (time.perf_counter() - start) / len(render_steps) * 1000
+
+    draw_ms, draw_spread = repeated(draw_pass, args.repeat)
+    render_pass()
+    render_ms, render_spread = repeated(render_pass, args.repeat)
+    figures, anims, duration = len(document.store), len(document.store.anim_kind), document.duration
+    del document, target
+
+    tracemalloc.start()
+    document, _ = load_case(file_name)
+    document.render_image(0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'figures': figures, 'anims': anims, 'duration': duration,
+            'load_ms': load_ms, 'load_ms_spread': load_spread,
+            'draw_ms': draw_ms, 'draw_ms_spread': draw_spread,
+            'render_ms': render_ms, 'render_ms_spread': render_spread,
+            'peak_mib': peak / 2 ** 20}
+
+
+def compare(results, baseline, tolerance):
+    # Изменения относительно сохранённого замера. Регрессия - метрика хуже
+    # больше чем на tolerance, и разница больше порога шума метрики и разброса
+    # повторов в обоих замерах. Возвращает число регрессий
+    if baseline.get('version') != SUITE_VERSION:
+        print(f'Замер {baseline.get("version")} другой версии, чем {SUITE_VERSION}, '
+              f'сравнение пропущено')
+        return 0
+    regressions = 0
+    print(f'{"Сцена":28} {"метрика":>10} {"было":>10} {"стало":>10} {"изм.":>8}')
+    for name, case in results['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            continue
+        for metric, floor in SUITE_METRICS.items():
+            if not old.get(metric):
+                continue
+            difference = case[metric] - old[metric]
+            spread = case.get(metric + '_spread', 0) + old.get(metric + '_spread', 0)
+            change = difference / old[metric]
+            mark = ''
+            if change > tolerance and difference > max(floor, NOISE_SPREAD * spread):
+                regressions += 1
+                mark = ' хуже'
+            print(f'{name:28} {metric:>10} {old[metric]:10.2f} {case[metric]:10.2f} '
+                  f'{change:+8.1%}{mark}')
+    return regressions
+
+
+def run_suite(args):
+    results = {'version': SUITE_VERSION,
+               'platform': {'python': platform.python_version(), 'qt': QT_VERSION_STR,
+                            'pyqt': PYQT_VERSION_STR, 'machine': platform.machine(),
+                            'system': platform.system(), 'cpus': os.cpu_count()},
+               'settings': {'frames': args.frames, 'render_frames': args.render_frames,
+                            'repeat': args.repeat, 'figures': args.figures},
+               'cases': {}}
+    print(f'{"Сцена":28} {"фигур":>7} {"загр. мс":>9} {"мс/кадр":>8} {"пик МиБ":>8} '
+          f'{"выв. мс":>8}')
+    with tempfile.TemporaryDirectory() as folder:
+        files = [(os.path.relpath(name), name) for name in suite_files()]
+        for count in args.figures:
+            file_name = os.path.join(folder, f'synthetic {count}.txt')
+            with open(file_name, 'w', encoding='utf-8') as f:
+                f.write(synthetic_script(count))
+            files.append((f'synthetic/{count}', file_name))
+        for name, file_name in files:
+            case = results['cases'][name] = bench_case(file_name, args)
+            print(f'{name:28} {case["figures"]:7} {case["load_ms"]:9.2f} {case["draw_ms"]:8.3f} '
+                  f'{case["peak_mib"]:8.2f} {case["render_ms"]:8.3f}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'Регрессий: {regressions}')
+            return 1
+    return 0
+
+
+def image_difference(first, second):
+    # доля пикселей, отличающихся больше чем на 16 по какому-нибудь каналу
+    first = first.convertToFormat(QImage.Format_RGB32)
+    second = second.convertToFormat(QImage.Format_RGB32)
+    width, height = first.width(), first.height()
+    a = np.frombuffer(first.constBits().asstring(first.sizeInBytes()), np.uint8)
+    b = np.frombuffer(second.constBits().asstring(second.sizeInBytes()), np.uint8)
+    a = a.reshape(height, -1, 4)[:, :width, :3].astype(np.int16)
+    b = b.reshape(height, -1, 4)[:, :width, :3].astype(np.int16)
+    return float(np.mean(np.abs(a - b).max(-1) > 16))
+
+
+def run_backends(args):
+    # время кадра на одних и тех же сценах: QPainter в QImage и OpenGL в буфере кадра
+    gl = glcanvas.gl_available()
+    if not gl:
+        print('OpenGL 4.1 недоступен, замеряется только QPainter')
+    print(f'{"Сцена":24} {"фигур":>7} {"QPainter мс":>12} {"OpenGL мс":>10} {"x":>6} {"разн.":>6}')
+    with tempfile.TemporaryDirectory() as folder:
+        files = example_files()
+        for count in args.figures:
+            file_name = os.path.join(folder, f'synthetic {count}.txt')
+            with open(file_name, 'w', encoding='utf-8') as f:
+                f.write(synthetic_script(count))
+            files.append(file_name)
+        for file_name in files:
+            document, _ = load_case(file_name)
+            steps = case_steps(document, args.frames)
+            document.render_image(0)
+            start = time.perf_counter()
+            for step in steps:
+                image = document.render_image(step)
+            raster_ms = (time.perf_counter() - start) * 1000 / len(steps)
+            row = f'{os.path.basename(file_name):24} {len(document.store):7} {raster_ms:12.3f}'
+            if gl:
+                renderer = glcanvas.GLImageRenderer(document.width, document.height)
+                renderer.render(document, 0)
+                start = time.perf_counter()
+                for step in steps:
+                    renderer.render(document, step)
+                gl_ms = (time.perf_counter() - start) * 1000 / len(steps)
+                difference = image_difference(image, renderer.image())
+                row += f' {gl_ms:10.3f} {raster_ms / gl_ms:6.2f} {difference:6.1%}'
+            print(row)
+
+
+def bench_startup(compiled):
+    # от запуска интерпретатора до первой отрисовки окна и до первого кадра примера, мс
+    start = time.time()
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(compiled=compiled)],
+                            capture_output=True, text=True, check=True).stdout
+    window, frame = map(float, output.split())
+    return (window - start) * 1000, (frame - start) * 1000
+
+
+def run_startup(args):
+    import build_ui
+    build_ui.build()
+    print(f'{"Интерфейс":12} {"окно мс":>9} {"кадр мс":>9}   (медиана из {args.repeat})')
+    for compiled, name in ((False, 'loadUi'), (True, 'собранный')):
+        times = [bench_startup(compiled) for _ in range(args.repeat)]
+        window = statistics.median(window for window, frame in times)
+        frame = statistics.median(frame for window, frame in times)
+        print(f'{name:12} {window:9.1f} {frame:9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры скорости отрисовки на examples/')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('draw', help='время отрисовки кадра в окне')
+    export = commands.add_parser('export', help='масштабирование выгрузки по процессам')
+    export.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    export.add_argument('--frames', type=int, default=400)
+    load = commands.add_parser('load', help='время загрузки скриптов, мс')
+    load.add_argument('--figures', type=int, nargs='*', default=[10000, 100000],
+                      help='размеры синтетических сцен')
+    memory = commands.add_parser('memory', help='память документа на синтетических сценах')
+    memory.add_argument('--figures', type=int, nargs='+', default=[1000, 10000, 100000])
+    edit = commands.add_parser('edit', help='правка одной фигуры против перезагрузки сцены, мс')
+    edit.add_argument('--figures', type=int, nargs='+', default=[1000, 10000, 100000])
+    edit.add_argument('--repeat', type=int, default=5)
+    backends = commands.add_parser('backends', help='время кадра на QPainter и на OpenGL')
+    backends.add_argument('--figures', type=int, nargs='*', default=[1000, 10000, 100000],
+                          help='размеры синтетических сцен')
+    backends.add_argument('--frames', type=int, default=50, help='кадров на сцену')
+    startup = commands.add_parser('startup', help='время запуска до первого кадра')
+    startup.add_argument('--repeat', type=int, default=10)
+    suite = commands.add_parser('suite', help='все замеры на examples/, letters/ и синтетических '
+                                              'сценах, результат в JSON')
+    suite.add_argument('--figures', type=int, nargs='*', default=[1000, 10000, 100000],
+                       help='размеры синтетических сцен')
+    suite.add_argument('--frames', type=int, default=50, help='кадров Document.draw на сцену')
+    suite.add_argument('--render-frames', type=int, default=50,
+                       help='кадров render_image на сцену, по всей шкале')
+    suite.add_argument('--repeat', type=int, default=5,
+                       help='повторов каждого замера времени, берётся медиана')
+    suite.add_argument('--output', '-o', help='файл JSON с результатами')
+    suite.add_argument('--baseline', help='сравнить с результатами из этого файла')
+    suite.add_argument('--tolerance', type=float, default=0.2,
+                       help='допустимое ухудшение метрики, доля')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    if args.command == 'export':
+        run_export(args)
+    elif args.command == 'load':
+        run_load(args)
+    elif args.command == 'memory':
+        run_memory(args)
+    elif args.command == 'edit':
+        run_edit(args)
+    elif args.command == 'startup':
+        run_startup(args)
+    elif args.command == 'backends':
+        run_backends(args)
+    elif args.command == 'suite':
+        sys.exit(run_suite(args))
+    else:
+        run_draw(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import re
+import sys
+import tempfile
+
+
+# файлы Qt Designer и ресурсов и модули Python, которые из них собираются
+UI_FILES = {'proekt.ui': 'ui_proekt.py', 'help.ui': 'ui_help.py'}
+RESOURCE_FILES = {'icons.qrc': 'icons_rc.py'}
+# модули собираются рядом с программой, из какой бы папки её ни запустили
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def resource_sources(qrc):
+    # сам .qrc и перечисленные в нём файлы
+    with open(qrc, 'r', encoding='utf-8') as f:
+        files = re.findall(r'<file[^>]*>(.*?)</file>', f.read())
+    folder = os.path.dirname(qrc)
+    return [qrc] + [os.path.join(folder, name) for name in files]
+
+
+def outdated(sources, target):
+    try:
+        built = os.path.getmtime(target)
+    except OSError:
+        return True
+    return any(os.path.getmtime(source) > built for source in sources)
+
+
+def write_module(target, write):
+    # Модуль пишется во временный файл рядом и подменяет старый целиком:
+    # прерванная сборка не оставит недописанный модуль, который новее своего .ui
+    handle, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(target) + '.',
+                                    dir=os.path.dirname(target))
+    os.close(handle)
+    try:
+        write(temp)
+        os.replace(temp, target)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def compile_ui(source, path):
+    from PyQt5 import uic
+    with open(path, 'w', encoding='utf-8') as f:
+        uic.compileUi(source, f)
+
+
+def compile_resources(source, path):
+    from PyQt5 import pyrcc_main
+    if not pyrcc_main.processResourceFile([source], path, False):
+        raise OSError(f'не удалось собрать {source}')
+
+
+def build(force=False):
+    # Пересобираются только модули старше своих исходников, поэтому проверка
+    # при каждом запуске программы стоит несколько stat. Возвращает собранные модули
+    built = []
+    for source, target in UI_FILES.items():
+        source, target = os.path.join(FOLDER, source), os.path.join(FOLDER, target)
+        if force or outdated([source], target):
+            write_module(target, lambda path: compile_ui(source, path))
+            built.append(target)
+    for source, target in RESOURCE_FILES.items():
+        source, target = os.path.join(FOLDER, source), os.path.join(FOLDER, target)
+        if force or outdated(resource_sources(source), target):
+            write_module(target, lambda path: compile_resources(source, path))
+            built.append(target)
+    return built
+
+
+if __name__ == '__main__':
+    for name in build(force='--force' in sys.argv):
+        print(os.path.relpath(name))
@@ -0,0 +1,123 @@
+import json
+import os
+import re
+
+from PyQt5.QtCore import Qt
+
+from glyphs import load_any_script, LOAD_ERRORS
+
+
+CATALOG_DIR = '.catalog'  # папка со сведениями и картинками рядом со скриптами
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+THUMBNAIL_SIZE = (160, 120)
+
+
+def natural_key(name):
+    # «Пример 2» раньше «Пример 10»
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def thumbnail_image(document):
+    # кадр, на котором закончились разовые анимации, уменьшенный до THUMBNAIL_SIZE
+    image = document.render_image(document.timeline.intro)
+    return image.scaled(*THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+class Catalog:
+    # Скрипты одной папки: число фигур, длительность, размер холста и картинка.
+    # Сведения хранятся в папке .catalog и пересчитываются только для файлов,
+    # у которых изменились время изменения или размер
+    def __init__(self, path):
+        self.path = path
+        self.folder = os.path.join(path, CATALOG_DIR)
+        self.entries = self.read_index()
+        self.names = []
+
+    def read_index(self):
+        try:
+            with open(os.path.join(self.folder, INDEX_FILE), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index['entries']
+
+    def write_index(self):
+        # сначала во временный файл, чтобы прерванная запись не портила старый индекс
+        os.makedirs(self.folder, exist_ok=True)
+        file_name = os.path.join(self.folder, INDEX_FILE)
+        with open(file_name + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(file_name + '.tmp', file_name)
+
+    def thumbnail(self, name):
+        return os.path.join(self.folder, name + '.png')
+
+    def scan(self):
+        # Имена скриптов по порядку и список тех, чьи сведения устарели.
+        # Файлы только перечисляются и stat-ятся, ничего не читается
+        names, stale = [], []
+        with os.scandir(self.path) as files:
+            for entry in files:
+                if not entry.name.endswith('.txt') or not entry.is_file():
+                    continue
+                names.append(entry.name)
+                stat = entry.stat()
+                known = self.entries.get(entry.name)
+                if known is None or (known['mtime'], known['size']) != \
+                        (stat.st_mtime_ns, stat.st_size):
+                    stale.append(entry.name)
+        names.sort(key=natural_key)
+        removed = set(self.entries) - set(names)
+        for name in removed:
+            del self.entries[name]
+            try:
+                os.remove(self.thumbnail(name))
+            except OSError:
+                pass
+        if removed and not stale:
+            # папка может быть только для чтения, тогда индекс просто не обновится
+            try:
+                self.write_index()
+            except OSError:
+                pass
+        self.names = names
+        return stale
+
+    def describe(self, name, make_document, cache):
+        # сведения о скрипте и картинка кадра, на котором закончились разовые анимации
+        file_name = os.path.join(self.path, name)
+        stat = os.stat(file_name)
+        entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        try:
+            script = load_any_script(file_name, cache)
+        except LOAD_ERRORS as error:
+            entry['error'] = str(error)
+            return entry
+        document = make_document()
+        document.load_script(script)
+        entry.update(figures=len(document.store), anims=len(document.store.anim_kind),
+                     duration=document.duration, width=document.width, height=document.height)
+        os.makedirs(self.folder, exist_ok=True)
+        thumbnail_image(document).save(self.thumbnail(name), 'PNG')
+        return entry
+
+    def describe_all(self, names, make_document, cache, progress):
+        # для фонового потока: новые сведения возвращаются, а в индекс их кладёт merge
+        entries = {}
+        for number, name in enumerate(names):
+            progress(number / len(names))
+            try:
+                entries[name] = self.describe(name, make_document, cache)
+            except OSError:
+                pass
+        return self, entries
+
+    def merge(self, entries):
+        self.entries.update(entries)
+        try:
+            self.write_index()
+        except OSError:
+            pass
@@ -0,0 +1,50 @@
+import functools
+import re
+
+import numpy as np
+
+
+LINEAR = 'linear'
+# кривые как в CSS: cubic-bezier(x1, y1, x2, y2)
+NAMED_CURVES = {'ease': (0.25, 0.1, 0.25, 1), 'ease-in': (0.42, 0, 1, 1),
+                'ease-out': (0, 0, 0.58, 1), 'ease-in-out': (0.42, 0, 0.58, 1)}
+# своя кривая пишется одним словом, без пробелов: bezier(0.1,0.7,1,0.1)
+BEZIER = re.compile(r'bezier\(([^,()]+),([^,()]+),([^,()]+),([^,()]+)\)$')
+CURVE_SAMPLES = 4097  # точек в таблице кривой, между ними - линейная интерполяция
+
+
+def is_easing(word):
+    return word == LINEAR or word in NAMED_CURVES or word.startswith('bezier(')
+
+
+def control_points(word):
+    # ValueError, если слово не кривая или x точек вне [0, 1]
+    if word in NAMED_CURVES:
+        return NAMED_CURVES[word]
+    match = BEZIER.match(word)
+    if match is None:
+        raise ValueError(f'неизвестная кривая «{word}»')
+    x1, y1, x2, y2 = map(float, match.groups())
+    if not (0 <= x1 <= 1 and 0 <= x2 <= 1):
+        raise ValueError(f'{word}: x точек кривой должны быть от 0 до 1')
+    return x1, y1, x2, y2
+
+
+@functools.lru_cache(maxsize=None)
+def curve_table(word):
+    # Кривая Безье по равномерным t: x(t) растёт, поэтому y(x) ищется
+    # через np.interp без решения уравнения для каждого значения
+    x1, y1, x2, y2 = control_points(word)
+    t = np.linspace(0, 1, CURVE_SAMPLES)
+    u = 1 - t
+    xs = 3 * u * u * t * x1 + 3 * u * t * t * x2 + t ** 3
+    ys = 3 * u * u * t * y1 + 3 * u * t * t * y2 + t ** 3
+    return xs, ys
+
+
+def ease(word, progress):
+    # доля пройденного времени -> доля пройденного пути; 0 и 1 остаются на месте
+    if word == LINEAR:
+        return progress
+    xs, ys = curve_table(word)
+    return np.interp(progress, xs, ys)
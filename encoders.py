@@ -0,0 +1,229 @@
+import io
+import os
+import queue
+import shutil
+import struct
+import threading
+
+from PyQt5.QtGui import QImage
+from PIL import Image, GifImagePlugin
+
+
+ANIMATED_FORMATS = ('.gif', '.webp')
+FRAME_NAME = 'frame_{:06d}.png'
+# быстрое сжатие: при отрисовке в PNG основное время уходит на zlib
+PNG_COMPRESS_LEVEL = 1
+ENCODER_QUEUE = 16  # сколько кадров может ждать кодирования
+GIF_MAX_DURATION = 655350  # больше в кадр GIF не записать, мс
+WEBP_MAX_DURATION = 2 ** 24 - 1
+WEBP_QUALITY = 80
+# кадры непрозрачные и во весь холст, накладывать их на предыдущие не нужно
+WEBP_NO_BLEND = 0b10
+WEBP_FRAME_CHUNKS = (b'ALPH', b'VP8 ', b'VP8L')
+CHUNK_HEADER = struct.Struct('<4sI')
+
+
+def frame_path(output, number):
+    return os.path.join(output, FRAME_NAME.format(number))
+
+
+def is_animated(output):
+    return output.lower().endswith(ANIMATED_FORMATS)
+
+
+def to_pil(image):
+    if isinstance(image, Image.Image):
+        return image
+    image = image.convertToFormat(QImage.Format_RGB888)
+    data = image.constBits().asstring(image.sizeInBytes())
+    return Image.frombuffer('RGB', (image.width(), image.height()), data, 'raw', 'RGB',
+                            image.bytesPerLine(), 1)
+
+
+def save_png(image, output, number):
+    to_pil(image).save(frame_path(output, number), compress_level=PNG_COMPRESS_LEVEL)
+
+
+def uint24(value):
+    return value.to_bytes(3, 'little')
+
+
+def riff_chunk(name, data):
+    # данные нечётной длины дополняются нулём
+    return CHUNK_HEADER.pack(name, len(data)) + data + b'\0' * (len(data) % 2)
+
+
+# Кодировщики получают кадры по порядку: add(номер, картинка, источник).
+# Картинка None - кадр такой же, как предыдущий или как кадр с номером источника
+
+class PngFrames:
+    # Папка PNG-кадров, повторы копируются готовыми файлами
+    def __init__(self, output, frame_duration):
+        os.makedirs(output, exist_ok=True)
+        self.output = output
+        self.last = None
+        self.encoded = 0
+
+    def add(self, number, image, source):
+        if image is None:
+            source = self.last if source is None else source
+            shutil.copyfile(frame_path(self.output, source), frame_path(self.output, number))
+        else:
+            save_png(image, self.output, number)
+            self.encoded += 1
+        self.last = number
+
+    def close(self):
+        pass
+
+
+class AnimatedFrames:
+    # Общее для GIF и WebP: кадр пишется, только когда пришёл следующий
+    # другой кадр, а повторы предыдущего лишь добавляют ему длительности
+    MAX_DURATION = 0
+
+    def __init__(self, output, frame_duration):
+        self.file = open(output, 'wb')
+        self.frame_duration = frame_duration
+        self.pending = None
+        self.duration = 0
+        self.encoded = 0
+
+    def add(self, number, image, source):
+        if image is None:
+            self.duration += self.frame_duration
+            return
+        self.flush()
+        self.pending = self.prepare(to_pil(image))
+        self.duration = self.frame_duration
+        self.encoded += 1
+
+    def flush(self):
+        if self.pending is None:
+            return
+        duration = self.duration
+        # слишком долгий кадр повторяется несколько раз
+        while duration > 0:
+            part = min(duration, self.MAX_DURATION)
+            self.write(self.pending, part)
+            duration -= part
+        self.pending = None
+
+    def close(self):
+        try:
+            self.flush()
+            self.finish()
+        finally:
+            self.file.close()
+
+
+class GifFrames(AnimatedFrames):
+    # У каждого кадра своя палитра, заголовок файла - по первому кадру
+    MAX_DURATION = GIF_MAX_DURATION
+
+    def __init__(self, output, frame_duration):
+        super().__init__(output, frame_duration)
+        self.started = False
+
+    def prepare(self, frame):
+        return frame if frame.mode == 'P' else frame.quantize()
+
+    def write(self, frame, duration):
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(frame.copy(), None, {'loop': 0,
+                                                                     'duration': duration})
+            self.file.write(b''.join(header))
+            self.started = True
+        self.file.write(b''.join(GifImagePlugin.getdata(frame, duration=duration,
+                                                        include_color_table=True)))
+
+    def finish(self):
+        self.file.write(b';')
+
+
+class WebpFrames(AnimatedFrames):
+    # Кадр сжимается Pillow как отдельная картинка, его данные складываются
+    # в кадры ANMF контейнера RIFF; размер файла дописывается в конце
+    MAX_DURATION = WEBP_MAX_DURATION
+
+    def __init__(self, output, frame_duration):
+        super().__init__(output, frame_duration)
+        self.size = None
+
+    def prepare(self, frame):
+        buffer = io.BytesIO()
+        frame.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=0)
+        data = buffer.getvalue()
+        chunks = []
+        offset = 12  # RIFF, размер, WEBP
+        while offset < len(data):
+            name, size = CHUNK_HEADER.unpack_from(data, offset)
+            if name in WEBP_FRAME_CHUNKS:
+                chunks.append(data[offset:offset + CHUNK_HEADER.size + size + size % 2])
+            offset += CHUNK_HEADER.size + size + size % 2
+        return frame.size, b''.join(chunks)
+
+    def write(self, frame, duration):
+        (width, height), chunks = frame
+        if self.size is None:
+            self.size = width, height
+            # флаг анимации, холст, фон и бесконечный повтор
+            self.file.write(b'RIFF\0\0\0\0WEBP')
+            self.file.write(riff_chunk(b'VP8X', bytes([0b10, 0, 0, 0]) + uint24(width - 1)
+                                       + uint24(height - 1)))
+            self.file.write(riff_chunk(b'ANIM', bytes([255, 255, 255, 255]) + bytes(2)))
+        header = uint24(0) + uint24(0) + uint24(width - 1) + uint24(height - 1) + \
+            uint24(duration) + bytes([WEBP_NO_BLEND])
+        self.file.write(riff_chunk(b'ANMF', header + chunks))
+
+    def finish(self):
+        size = self.file.tell()
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', size - 8))
+
+
+def open_encoder(output, frame_duration):
+    if output.lower().endswith('.gif'):
+        return GifFrames(output, frame_duration)
+    if output.lower().endswith('.webp'):
+        return WebpFrames(output, frame_duration)
+    return PngFrames(output, frame_duration)
+
+
+class EncoderThread:
+    # Кодирование и запись в своём потоке. Кадры ждут в очереди не больше
+    # ENCODER_QUEUE штук: отрисовка не убегает вперёд, и память не растёт
+    # с числом кадров. Ошибка записи поднимается при следующем кадре
+    def __init__(self, encoder, size=ENCODER_QUEUE):
+        self.encoder = encoder
+        self.queue = queue.Queue(size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, number, image, source):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((number, image, source))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # после ошибки очередь только разбирается, чтобы не встала отрисовка
+            if self.error is None:
+                try:
+                    self.encoder.add(*item)
+                except Exception as error:
+                    self.error = error
+        try:
+            self.encoder.close()
+        except Exception as error:
+            self.error = self.error or error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+FRAME_CACHE_BYTES = 256 * 2 ** 20  # сколько памяти можно отдать под готовые кадры
+PREFETCH_FRAMES = 8  # сколько кадров вперёд готовить заранее
+# кадры, которые рисуются быстрее, дешевле рисовать сразу, чем копировать из кэша
+PREFETCH_MIN_MS = 8
+
+
+class FrameCache:
+    # Готовые кадры документа по номеру шага: при переполнении бюджета
+    # выбрасываются кадры, которые дольше всего не показывались.
+    # Кадры кладёт и фоновый поток, поэтому все обращения под замком
+    def __init__(self, budget=FRAME_CACHE_BYTES):
+        self.budget = budget
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # номер поколения: кадры, нарисованные до clear(), уже не кладутся
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, step):
+        return step in self.frames
+
+    def get(self, step):
+        with self.lock:
+            frame = self.frames.get(step)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(step)
+            self.hits += 1
+            return frame
+
+    def put(self, step, frame, generation):
+        size = frame.sizeInBytes()
+        with self.lock:
+            if generation != self.generation or step in self.frames or size > self.budget:
+                return
+            self.frames[step] = frame
+            self.nbytes += size
+            while self.nbytes > self.budget:
+                _, old = self.frames.popitem(last=False)
+                self.nbytes -= old.sizeInBytes()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+            self.generation += 1
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+
+class Prefetcher:
+    # Один фоновый поток рисует кадры, которые скоро понадобятся.
+    # Новый запрос отменяет недоделанный старый
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.request = 0
+
+    def prefetch(self, document, steps):
+        self.request += 1
+        cache = document.frames
+        steps = [step for step in steps if step not in cache]
+        if steps:
+            # статичный слой и списки фигур берутся здесь, чтобы поток рисовал
+            # по одному согласованному набору, даже если документ тем временем правят
+            layer = document.get_static_layer()
+            self.executor.submit(self.run, self.request, document, steps, layer,
+                                 document.dynamic_view(), cache.generation)
+
+    def run(self, request, document, steps, layer, view, generation):
+        for step in steps:
+            # после правки (новый номер правки) кадры по старому набору не нужны
+            if request != self.request or generation != document.frames.generation or \
+                    view[0] != document.revision:
+                return
+            frame = document.render_frame(step, layer, view)
+            if view[0] == document.revision:
+                document.frames.put(step, frame, generation)
+
+    def shutdown(self):
+        self.request += 1
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,288 @@
+import numpy as np
+from PyQt5.QtGui import QOpenGLContext, QOpenGLBuffer, QOpenGLShader, QOpenGLShaderProgram, \
+    QOpenGLVertexArrayObject, QOpenGLVersionProfile, QSurfaceFormat, QOffscreenSurface, \
+    QOpenGLFramebufferObject
+from PyQt5.QtWidgets import QOpenGLWidget
+
+
+GL_VERSION = (4, 1)  # есть во всех Mesa, включая llvmpipe, и на macOS
+GL_FLOAT = 0x1406
+GL_TRIANGLE_STRIP = 0x0005
+GL_COLOR_BUFFER_BIT = 0x4000
+GL_BLEND, GL_DEPTH_TEST, GL_SCISSOR_TEST = 0x0BE2, 0x0B71, 0x0C11
+FLOAT_SIZE = 4
+# на фигуру: матрица 2x3 (меняется по кадрам), границы, тип, цвет заливки и пера (постоянные)
+MATRIX_FLOATS = 6
+SHAPE_FLOATS = 13
+
+# Каждая фигура - экземпляр одного четырёхугольника по её границам,
+# а круг и треугольник вырезаются из него во фрагментном шейдере.
+# Один вызов рисования на все фигуры сохраняет порядок наложения
+VERTEX_SHADER = '''
+#version 330 core
+layout(location = 0) in vec2 corner;
+layout(location = 1) in vec3 row0;
+layout(location = 2) in vec3 row1;
+layout(location = 3) in vec4 bounds;
+layout(location = 4) in float kind;
+layout(location = 5) in vec4 color;
+layout(location = 6) in vec4 pen_color;
+uniform vec2 canvas;
+out vec2 local;
+flat out vec4 box;
+flat out vec2 pixel;
+flat out int shape;
+out vec4 fill;
+out vec4 outline;
+
+void main() {
+    // перо QPainter в один пиксель выходит за фигуру на полпикселя
+    pixel = 1.0 / max(vec2(length(vec2(row0.x, row1.x)), length(vec2(row0.y, row1.y))), 1e-6);
+    local = mix(bounds.xy - pixel, bounds.zw + pixel, corner);
+    vec2 point = vec2(dot(row0, vec3(local, 1.0)), dot(row1, vec3(local, 1.0)));
+    gl_Position = vec4(point.x / canvas.x * 2.0 - 1.0, 1.0 - point.y / canvas.y * 2.0, 0.0, 1.0);
+    box = bounds;
+    shape = int(kind);
+    fill = color;
+    outline = pen_color;
+}
+'''
+
+FRAGMENT_SHADER = '''
+#version 330 core
+in vec2 local;
+flat in vec4 box;
+flat in vec2 pixel;
+flat in int shape;
+in vec4 fill;
+in vec4 outline;
+out vec4 result;
+
+void main() {
+    // inside - дальше полпикселя от края: там заливка, ближе - перо
+    vec2 pen = pixel * 0.5;
+    if (any(lessThan(local, box.xy - pen)) || any(greaterThan(local, box.zw + pen)))
+        discard;
+    bool inside = all(greaterThanEqual(local, box.xy + pen)) &&
+                  all(lessThanEqual(local, box.zw - pen));
+    if (shape == 1) {
+        // круг вписан в квадрат от (0, 0) до (r, r)
+        vec2 radius = (box.zw - box.xy) * 0.5;
+        vec2 center = (box.xy + box.zw) * 0.5;
+        vec2 d = (local - center) / (radius + pen);
+        if (dot(d, d) > 1.0)
+            discard;
+        vec2 e = (local - center) / max(radius - pen, vec2(1e-6));
+        inside = dot(e, e) <= 1.0;
+    } else if (shape == 2) {
+        // вершина вверху, основание на нижней границе
+        float height = box.w - box.y;
+        float half_width = box.z * (local.y - box.y) / height;
+        if (abs(local.x) > half_width + pen.x)
+            discard;
+        inside = inside && abs(local.x) <= half_width - pen.x;
+    }
+    result = inside ? fill : outline;
+}
+'''
+
+
+def surface_format():
+    fmt = QSurfaceFormat()
+    fmt.setVersion(*GL_VERSION)
+    fmt.setProfile(QSurfaceFormat.CoreProfile)
+    return fmt
+
+
+def gl_available():
+    # можно ли создать контекст нужной версии (на машинах без GPU - через llvmpipe)
+    context = QOpenGLContext()
+    context.setFormat(surface_format())
+    return context.create() and context.format().version() >= GL_VERSION
+
+
+def draw_order(document):
+    # порядок экземпляров: сначала неанимированные фигуры, потом анимированные,
+    # как в Document.paint
+    return np.concatenate([np.flatnonzero(document.store.anim_count == 0),
+                           document.scene.animated])
+
+
+def static_matrices(document, count):
+    # матрицы всех экземпляров; неанимированные фигуры только сдвинуты в свой центр,
+    # места анимированных заполняются на каждом кадре
+    store = document.store
+    static = np.flatnonzero(store.anim_count == 0)
+    matrices = np.zeros((count, MATRIX_FLOATS), dtype=np.float32)
+    matrices[:len(static), [0, 4]] = 1
+    matrices[:len(static), 2] = store.x[static]
+    matrices[:len(static), 5] = store.y[static]
+    return matrices
+
+
+def shape_data(document, order):
+    store = document.store
+    shapes = np.zeros((len(order), SHAPE_FLOATS), dtype=np.float32)
+    shapes[:, 0:4] = store.local_bounds()[order]
+    shapes[:, 4] = store.kind[order]
+    palette = np.array([color.getRgbF() for color in store.qcolors] or [(0, 0, 0, 1)],
+                       dtype=np.float32).reshape(-1, 4)
+    shapes[:, 5:9] = palette[store.color[order]]
+    shapes[:, 9:13] = shapes[:, 5:9]
+    fig = document.select_figure
+    if fig is not None:
+        # выделенная фигура закрашивается обратным цветом, а перо у неё своего
+        # цвета, как в Figure.draw_start
+        slot = np.flatnonzero(order == fig.index)
+        shapes[slot, 5:8] = 1 - shapes[slot, 5:8]
+    return shapes
+
+
+class GLRenderer:
+    # Фигуры документа загружаются в буферы один раз, а на кадр
+    # обновляются только матрицы анимированных фигур
+    def __init__(self):
+        self.gl = None
+        self.document = None
+        self.revision = None
+        self.selected = None
+
+    def initialize(self, context):
+        profile = QOpenGLVersionProfile()
+        profile.setVersion(*GL_VERSION)
+        profile.setProfile(QSurfaceFormat.CoreProfile)
+        self.gl = context.versionFunctions(profile)
+        self.gl.initializeOpenGLFunctions()
+        self.program = QOpenGLShaderProgram()
+        self.program.addShaderFromSourceCode(QOpenGLShader.Vertex, VERTEX_SHADER)
+        self.program.addShaderFromSourceCode(QOpenGLShader.Fragment, FRAGMENT_SHADER)
+        if not self.program.link():
+            raise RuntimeError(self.program.log())
+        self.vao = QOpenGLVertexArrayObject()
+        self.vao.create()
+        self.vao.bind()
+        self.corners = self.create_buffer(np.array([0, 0, 1, 0, 0, 1, 1, 1], dtype=np.float32))
+        self.program.enableAttributeArray(0)
+        self.program.setAttributeBuffer(0, GL_FLOAT, 0, 2)
+        self.matrices = self.create_buffer()
+        self.shapes = self.create_buffer()
+        self.vao.release()
+        self.document = None
+
+    def create_buffer(self, data=None):
+        buffer = QOpenGLBuffer(QOpenGLBuffer.VertexBuffer)
+        buffer.create()
+        buffer.setUsagePattern(QOpenGLBuffer.StaticDraw if data is not None
+                               else QOpenGLBuffer.DynamicDraw)
+        buffer.bind()
+        if data is not None:
+            buffer.allocate(data, data.nbytes)
+        return buffer
+
+    def upload(self, document):
+        # новый или изменённый документ: буферы экземпляров создаются заново
+        self.order = draw_order(document)
+        matrices = static_matrices(document, len(self.order))
+        shapes = shape_data(document, self.order)
+        self.count = len(matrices)
+        self.first_dynamic = self.count - len(document.scene)
+        self.document = document
+        self.revision = document.revision
+        self.selected = document.select_figure
+        if not self.count:
+            return
+        self.vao.bind()
+        self.matrices.bind()
+        self.matrices.allocate(matrices, matrices.nbytes)
+        stride = MATRIX_FLOATS * FLOAT_SIZE
+        for location, offset in ((1, 0), (2, 3)):
+            self.program.enableAttributeArray(location)
+            self.program.setAttributeBuffer(location, GL_FLOAT, offset * FLOAT_SIZE, 3, stride)
+            self.gl.glVertexAttribDivisor(location, 1)
+        self.shapes.bind()
+        self.shapes.allocate(shapes, shapes.nbytes)
+        stride = SHAPE_FLOATS * FLOAT_SIZE
+        for location, offset, size in ((3, 0, 4), (4, 4, 1), (5, 5, 4), (6, 9, 4)):
+            self.program.enableAttributeArray(location)
+            self.program.setAttributeBuffer(location, GL_FLOAT, offset * FLOAT_SIZE, size, stride)
+            self.gl.glVertexAttribDivisor(location, 1)
+        self.vao.release()
+
+    def update_colors(self, document):
+        self.selected = document.select_figure
+        if not self.count:
+            return
+        shapes = shape_data(document, self.order)
+        self.shapes.bind()
+        self.shapes.write(0, shapes, shapes.nbytes)
+
+    def render(self, document, step, width, height):
+        gl = self.gl
+        # QPainter (надпись замеров) мог оставить своё состояние
+        for capability in (GL_BLEND, GL_DEPTH_TEST, GL_SCISSOR_TEST):
+            gl.glDisable(capability)
+        gl.glClearColor(1, 1, 1, 1)
+        gl.glClear(GL_COLOR_BUFFER_BIT)
+        if document is not self.document or document.revision != self.revision:
+            self.upload(document)
+        elif document.select_figure != self.selected:
+            self.update_colors(document)
+        if not self.count:
+            return
+        if self.count > self.first_dynamic:
+            matrices, bounds = document.frame_state(step)
+            rows = matrices.reshape(-1, MATRIX_FLOATS).astype(np.float32)
+            self.matrices.bind()
+            self.matrices.write(self.first_dynamic * MATRIX_FLOATS * FLOAT_SIZE, rows, rows.nbytes)
+        self.program.bind()
+        self.program.setUniformValue('canvas', float(width), float(height))
+        self.vao.bind()
+        gl.glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, self.count)
+        self.vao.release()
+        self.program.release()
+
+
+class GLCanvas(QOpenGLWidget):
+    # Холст на OpenGL вместо QPainter: кадр рисуется GLRenderer,
+    # остальное (счётчик кадров, замеры) - в Form.frame_painted
+    def __init__(self, form):
+        super().__init__()
+        self.form = form
+        self.setFormat(surface_format())
+        self.renderer = GLRenderer()
+
+    def initializeGL(self):
+        self.renderer.initialize(self.context())
+
+    def paintGL(self):
+        document = self.form.document
+        self.renderer.render(document, document.step, self.width(), self.height())
+        self.form.frame_painted()
+
+
+class GLImageRenderer:
+    # Кадры в картинку без окна: тот же GLRenderer в буфере кадра, для замеров
+    def __init__(self, width, height):
+        self.context = QOpenGLContext()
+        self.context.setFormat(surface_format())
+        if not self.context.create():
+            raise RuntimeError('OpenGL недоступен')
+        self.surface = QOffscreenSurface()
+        self.surface.setFormat(self.context.format())
+        self.surface.create()
+        self.context.makeCurrent(self.surface)
+        self.fbo = QOpenGLFramebufferObject(width, height)
+        self.width, self.height = width, height
+        self.renderer = GLRenderer()
+        self.renderer.initialize(self.context)
+
+    def render(self, document, step):
+        self.context.makeCurrent(self.surface)
+        self.fbo.bind()
+        self.renderer.gl.glViewport(0, 0, self.width, self.height)
+        self.renderer.render(document, step, self.width, self.height)
+        self.renderer.gl.glFinish()
+        self.fbo.release()
+
+    def image(self):
+        return self.fbo.toImage()
@@ -0,0 +1,238 @@
+import math
+import os
+import zlib
+
+import numpy as np
+
+from script_parser import FIGURE_DTYPE, ANIM_DTYPE, FIGURE_KINDS, ANIM_KINDS, Script, \
+    ScriptError, load_script
+
+LETTERS_PATH = 'letters/'
+# буква в файлах занимает клетку 40x60 вокруг начала координат, ось y направлена вверх
+GLYPH_WIDTH, GLYPH_HEIGHT = 40, 60
+LETTER_SCALE = 1.5
+LETTER_SPACING = 10
+LINE_SPACING = 20
+MARGIN = 20
+# латинские имена файлов (B_krugi.txt) и буквы, которые они обозначают
+TRANSLIT = {'A': 'А', 'B': 'Б', 'V': 'В', 'G': 'Г'}
+COMPACT_KINDS = {'pryamougolniki': 0, 'krugi': 1, 'treugolniki': 2}
+# первая буква строки в коротком формате, латиница и кириллица
+COMPACT_FIGURES = {'R': 0, 'П': 0, 'C': 1, 'С': 1, 'T': 2, 'Т': 2}
+# флажки анимаций в окне: увеличение, вращение, полёт
+ANIM_ORDER = ('scale', 'rotate', 'move')
+ANIM_TIME = 2000  # шагов на анимацию первой буквы
+LETTER_DELAY = 150  # каждая следующая буква собирается на столько шагов дольше
+TEXT_COLORS = ('black', 'red', 'blue', 'green', 'purple', 'orange')
+LAYOUT_CACHE_SIZE = 32
+# чем может закончиться load_any_script на испорченном или чужом файле
+LOAD_ERRORS = (ScriptError, OSError, UnicodeDecodeError, ValueError, KeyError)
+
+
+def glyph_files(path=LETTERS_PATH):
+    # {(буква, тип фигуры): имя файла} по именам файлов, сами файлы не читаются
+    files = {}
+    for name in os.listdir(path):
+        stem, ext = os.path.splitext(name)
+        if ext != '.txt':
+            continue
+        if '_' in stem:
+            letter, kind = stem.split('_', 1)
+            kind = COMPACT_KINDS.get(kind)
+        else:
+            letter, _, kind = stem.partition(' ')
+            kind = int(kind) - 1 if kind.isdigit() else None
+        letter = TRANSLIT.get(letter, letter)
+        if len(letter) == 1 and kind in (0, 1, 2):
+            files[letter, kind] = os.path.join(path, name)
+    return files
+
+
+def is_compact(file_name):
+    # Короткий формат узнаётся по содержимому, а не по имени: его первая строка
+    # начинается с буквы фигуры, а первая строка скрипта - с размера холста
+    with open(file_name, 'rb') as f:
+        for line in f:
+            tokens = line.decode('cp1251', errors='replace').split()
+            if tokens:
+                return tokens[0] in COMPACT_FIGURES
+    return False
+
+
+def read_compact(file_name):
+    # строки «R x y ширина высота угол», «T x y размер угол», «C x y размер угол»
+    with open(file_name, 'rb') as f:
+        lines = f.read().decode('cp1251').splitlines()
+    rows = []
+    for number, line in enumerate(lines, 1):
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] not in COMPACT_FIGURES:
+            raise ScriptError(f'неизвестная фигура «{tokens[0]}»', number, file_name)
+        kind = COMPACT_FIGURES[tokens[0]]
+        count = 5 if kind == 0 else 4
+        try:
+            values = [float(x) for x in tokens[1:]]
+        except ValueError:
+            raise ScriptError(f'неверное число в «{line.strip()}»', number, file_name) from None
+        if len(values) != count:
+            raise ScriptError(f'{tokens[0]}: ожидалось чисел: {count}, получено: {len(values)}',
+                              number, file_name)
+        if kind == 0:
+            x, y, width, height, angle = values
+        else:
+            (x, y, width, angle), height = values, 0
+            if kind == 2:
+                # размер - сторона клетки, у треугольника в скрипте радиус
+                width /= math.sqrt(3)
+        rows.append((kind, x, y, width, height, angle, 0, 0, 0))
+    return np.array(rows, dtype=FIGURE_DTYPE)
+
+
+def read_glyph(file_name):
+    # фигуры буквы с центром в начале координат и осью y вниз, как на холсте
+    if is_compact(file_name):
+        figures = read_compact(file_name)
+    else:
+        figures = np.array(load_script(file_name).figures)
+        figures['anim_count'] = 0
+    # половины ширины и высоты фигур, как их рисует Document
+    kind, size = figures['kind'], figures['width']
+    half_width = np.where(kind == 2, size * math.sqrt(3) / 2, size / 2)
+    half_height = np.where(kind == 0, figures['height'] / 2, np.where(kind == 1, size / 2, size))
+    x0, x1 = (figures['x'] - half_width).min(), (figures['x'] + half_width).max()
+    y0, y1 = (figures['y'] - half_height).min(), (figures['y'] + half_height).max()
+    figures['x'] -= (x0 + x1) / 2
+    figures['y'] = (y0 + y1) / 2 - figures['y']
+    # круг в скрипте рисуется от точки (x, y), а в файлах букв (x, y) - его центр
+    circle = kind == FIGURE_KINDS['circle']
+    figures['x'][circle] -= size[circle] / 2
+    figures['y'][circle] -= size[circle] / 2
+    # без анимации вращения угол фигуры не учитывается, так что буква
+    # в конце анимации выглядит так же, как без неё
+    figures['angle'] = 0
+    figures['color'] = 0
+    return figures
+
+
+def glyph_script(file_name):
+    # одна буква в центре своего холста, чтобы её можно было открыть как скрипт
+    figures = read_glyph(file_name)
+    figures['x'] += GLYPH_WIDTH
+    figures['y'] += GLYPH_HEIGHT
+    return Script(GLYPH_WIDTH * 2, GLYPH_HEIGHT * 2, figures, np.zeros(0, dtype=ANIM_DTYPE),
+                  [TEXT_COLORS[0]])
+
+
+def load_any_script(file_name, cache=False, progress=None):
+    # скрипт или файл буквы в коротком формате, который как скрипт не разбирается
+    if is_compact(file_name):
+        return glyph_script(file_name)
+    return load_script(file_name, cache, progress)
+
+
+class TextEngine:
+    # Превращает текст в скрипт анимации из фигур библиотеки letters/.
+    # Буквы читаются один раз, готовые сцены запоминаются по тексту и настройкам
+    def __init__(self, path=LETTERS_PATH):
+        self.files = glyph_files(path)
+        self.glyphs = {}
+        self.layouts = {}
+
+    def glyph(self, letter, kind):
+        key = letter, kind
+        if key not in self.glyphs:
+            self.glyphs[key] = read_glyph(self.files[key])
+        return self.glyphs[key]
+
+    def letter_kind(self, letter, kinds, number):
+        # выбранные типы фигур чередуются по буквам, а если нужного типа
+        # для буквы нет - берётся первый имеющийся
+        selected = [kind for kind, on in enumerate(kinds) if on and (letter, kind) in self.files]
+        if selected:
+            return selected[number % len(selected)]
+        return next((kind for kind in range(3) if (letter, kind) in self.files), None)
+
+    def missing(self, text):
+        return sorted({letter for letter in text if not letter.isspace() and
+                       self.letter_kind(letter, (True, True, True), 0) is None})
+
+    def layout(self, text, kinds, anims, width, height):
+        key = text, tuple(kinds), tuple(anims), width, height
+        if key not in self.layouts:
+            if len(self.layouts) >= LAYOUT_CACHE_SIZE:
+                del self.layouts[next(iter(self.layouts))]
+            self.layouts[key] = self.build(*key)
+        return self.layouts[key]
+
+    def places(self, text, width):
+        # центры букв: строки текста переносятся по словам по ширине холста
+        step = (GLYPH_WIDTH + LETTER_SPACING) * LETTER_SCALE
+        per_line = max(1, int((width - 2 * MARGIN + LETTER_SPACING * LETTER_SCALE) // step))
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            for word in paragraph.split():
+                while len(word) > per_line:
+                    if line:
+                        lines.append(line)
+                    lines.append(word[:per_line])
+                    line, word = '', word[per_line:]
+                if not line:
+                    line = word
+                elif len(line) + 1 + len(word) <= per_line:
+                    line += ' ' + word
+                else:
+                    lines.append(line)
+                    line = word
+            lines.append(line)
+        line_height = (GLYPH_HEIGHT + LINE_SPACING) * LETTER_SCALE
+        for row, line in enumerate(lines):
+            y = MARGIN + (row + 0.5) * line_height
+            for column, letter in enumerate(line):
+                if not letter.isspace():
+                    yield letter, MARGIN + column * step + GLYPH_WIDTH * LETTER_SCALE / 2, y
+
+    def build(self, text, kinds, anims, width, height):
+        parts = []
+        for number, (letter, x, y) in enumerate(self.places(text, width)):
+            kind = self.letter_kind(letter, kinds, number)
+            if kind is None:
+                continue
+            figures = self.glyph(letter, kind).copy()
+            for field in ('x', 'y', 'width', 'height'):
+                figures[field] *= LETTER_SCALE
+            figures['x'] += x
+            figures['y'] += y
+            figures['color'] = number % len(TEXT_COLORS)
+            parts.append((number, figures))
+        figures = np.concatenate([figures for number, figures in parts]) if parts else \
+            np.zeros(0, dtype=FIGURE_DTYPE)
+        numbers = np.concatenate([np.full(len(figures), number) for number, figures in parts]) \
+            if parts else np.zeros(0, dtype=np.int64)
+        # полёт идёт первым: вращение и увеличение - вокруг уже летящей фигуры
+        kinds = sorted(ANIM_KINDS[name] for name, on in zip(ANIM_ORDER, anims) if on)
+        count = len(figures)
+        anims = np.zeros(count * len(kinds), dtype=ANIM_DTYPE)
+        times = ANIM_TIME + numbers * LETTER_DELAY
+        for i, kind in enumerate(kinds):
+            column = anims[i::len(kinds)]
+            column['kind'] = kind
+            column['time'] = times
+            if kind == ANIM_KINDS['move']:
+                column['a'] = figures['x']
+                column['b'] = figures['y']
+            elif kind == ANIM_KINDS['rotate']:
+                column['a'] = 360
+            else:
+                column['a'] = 1
+        if ANIM_KINDS['move'] in kinds:
+            # фигуры слетаются в буквы из случайных, но одних и тех же для текста мест
+            rnd = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+            figures['x'] = rnd.uniform(0, width, count)
+            figures['y'] = rnd.uniform(0, height, count)
+        figures['anim_count'] = len(kinds)
+        figures['anim_start'] = np.arange(count) * len(kinds)
+        colors = list(TEXT_COLORS) if parts else []
+        return Script(width, height, figures, anims, colors)
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from glyphs import load_any_script
+
+
+LOAD_SHARE = 0.7  # доля чтения и разбора в ходе открытия, остальное - сборка сцены
+
+
+class Cancelled(Exception):
+    pass
+
+
+def open_document(document, file_name, cache, progress):
+    # Document собирается целиком в фоновом потоке, окно получает его готовым
+    script = load_any_script(file_name, cache, lambda part: progress(part * LOAD_SHARE))
+    progress(LOAD_SHARE)
+    document.build(script)
+    progress(1)
+    return document
+
+
+def save_document(document, file_name, progress):
+    # текст собирается кусками, а в файл пишется одним вызовом: при отмене
+    # или ошибке сборки старый файл остаётся как был
+    text = document.save_text(progress)
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return file_name
+
+
+class FileJobs(QObject):
+    # Открытие и сохранение скриптов в одном фоновом потоке. Ход работы
+    # и результат приходят сигналами в поток окна с номером задачи,
+    # у отменённой задачи результата нет
+    progress = pyqtSignal(int, int)  # задача, проценты
+    finished = pyqtSignal(int, object)  # задача, результат
+    failed = pyqtSignal(int, object)  # задача, исключение
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(1)
+        self.job = 0
+        self.cancelled = {}
+
+    def new_job(self):
+        # номер задачи выдаётся до запуска, чтобы окно успело её запомнить
+        self.job += 1
+        self.cancelled[self.job] = threading.Event()
+        return self.job
+
+    def start(self, job, function, *args, background=True):
+        # function(*args, progress) в фоновом потоке или сразу, если background=False
+        if background:
+            self.executor.submit(self.run, job, self.cancelled[job], function, args)
+        else:
+            self.run(job, self.cancelled[job], function, args)
+
+    def run(self, job, cancelled, function, args):
+        def progress(part):
+            if cancelled.is_set():
+                raise Cancelled
+            self.progress.emit(job, int(part * 100))
+
+        try:
+            result = function(*args, progress)
+        except Cancelled:
+            pass
+        except Exception as error:
+            self.failed.emit(job, error)
+        else:
+            self.finished.emit(job, result)
+        finally:
+            self.cancelled.pop(job, None)
+
+    def cancel(self, job):
+        cancelled = self.cancelled.get(job)
+        if cancelled is not None:
+            cancelled.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -1,300 +1,1069 @@
 from PyQt5.QtWidgets import QApplication, QWidget, QTextEdit, QPushButton, QLabel, QStyleFactory, \
-    QFileDialog, QMainWindow, QDesktopWidget, QVBoxLayout, QScrollArea, QSpacerItem, QSizePolicy, \
-    QErrorMessage
-from PyQt5.QtCore import QRect, Qt, QTimer, QEvent
-from PyQt5.QtGui import QIcon, QPainter, QColor, QPainterPath, QBrush
-from PyQt5 import uic
+    QFileDialog, QMainWindow, QDesktopWidget, QVBoxLayout, QScrollArea, QErrorMessage, QListView
+from PyQt5.QtCore import QRect, QRectF, QSize, QPointF, Qt, QTimer, QEvent, QElapsedTimer, \
+    QAbstractListModel, QItemSelectionModel, QModelIndex
+from PyQt5.QtGui import QIcon, QPainter, QColor, QPainterPath, QBrush, QImage, QRegion, QTransform, \
+    QPixmap
 import math
+import functools
+import importlib
+import io
 import sys
 import os
-from PIL import Image
+import time
+import numpy as np
+import build_ui
+from scene import CompiledScene, StateCache, to_qtransform
+from spatial import SpatialGrid, region_from_boxes
+from glyphs import TextEngine, LETTERS_PATH
+from easing import ease, LINEAR
+from catalog import Catalog, THUMBNAIL_SIZE
+from frames import FrameCache, Prefetcher, PREFETCH_FRAMES, PREFETCH_MIN_MS
+from timeline import Timeline, LOOP_CHOICES
+from profiler import profiler
+from loader import FileJobs, open_document, save_document
+from script_parser import ScriptError, FIGURE_NAMES, ANIM_NAMES, FIGURE_ARGS, ANIM_ARGS, \
+    FIGURE_KINDS, ANIM_KINDS, parse_script
+from store import FigureStore, FIGURE_COLUMNS
 
 
 EXAMPLES_PATH = 'examples/'
 BACK_AREA = 'background-color: white;'
 CONST_3_2_PI = math.sqrt(3) / 2
-DEFAULT_SPEED = 1
+DEFAULT_SPEED = 1000  # шагов анимации в секунду
+MAX_SPEED = 64000
+DEFAULT_REFRESH_RATE = 60
+SCRIPT_CACHE = True  # хранить рядом со скриптами двоичные копии *.anim.bin
+THUMBNAIL_CACHE = 512  # сколько картинок каталога держать в памяти
+SAVE_CHUNK = 10000  # по столько фигур собирается текст при сохранении
+CANVAS_BACKENDS = ('raster', 'gl')  # холст на QPainter или на OpenGL (python proekt.py gl)
+DEFAULT_CANVAS = 'raster'
+COMPILED_UI = True  # окна из модулей, собранных build_ui, а не разбором .ui при запуске
+DEFAULT_SIZE = (669, 619)
 
 
 class Document:
     def __init__(self, parent=None):
         self.step = 0
-        self.figures = []
+        self.store = FigureStore()
+        self.figures = FigureViews(self)
         self.widget = None
-        self.width = parent.scrollArea_3.width() - 2
-        self.height = parent.scrollArea_3.height() - 2
+        if parent:
+            self.width = parent.scrollArea_3.width() - 2
+            self.height = parent.scrollArea_3.height() - 2
+        else:
+            # документ без окна, например для отрисовки в файл
+            self.width, self.height = DEFAULT_SIZE
         self.figuresCount = 0
-        self.timer = QTimer()
         self.parent = parent
-        self.btn_list = []
         self.select_figure = None
-        self.dur_anims_cycle = []
-        self.dur_anims_no_cycle = []
-        self.duration = 0
-        self.update_list()
+        # сколько раз повторять циклы, None - без конца
+        self.loops = parent.loops if parent else 1
+        self.batches = None
+        self.static_layer = None
+        self.static_index = None
+        self.painted = None
+        # готовые кадры нужны только в окне, при отрисовке в файл кадры не повторяются
+        self.frames = FrameCache() if parent else None
+        self.stride = 1
+        self.paint_ms = 0
+        # номер правки: холст на OpenGL по нему видит, что буферы надо загрузить заново
+        self.revision = 0
+        # границы мест правки, которые ещё не перерисованы
+        self.edited = []
+        self.compile()
+        self.calc_duration()
 
     def set_widget(self, widget):
         self.widget = widget
         self.widget.setFixedWidth(self.width)
         self.widget.setFixedHeight(self.height)
+        self.invalidate_cache()
 
     def load_file(self, f):
-        self.width, self.height = map(int, f.readline().split())
-        self.figuresCount = int(f.readline())
-        for i in range(self.figuresCount):
-            name, *args = f.readline().split()
-            args = list(map(float, args[:-1])) + args[-1:]
-            if name == 'rectangle':
-                fig = Rectangle(*args, self)
-            elif name == 'circle':
-                fig = Circle(*args, self)
-            elif name == 'triangle':
-                fig = Triangle(*args, self)
-            figureAnimationsCount = int(f.readline())
-            for j in range(figureAnimationsCount):
-                fig.add_anim_str(f.readline().strip())
-            self.figures.append(fig)
-        self.update_list()
+        self.load_script(parse_script(f.read()))
+
+    def load_script(self, script):
+        self.build(script)
+        self.attach()
+
+    def build(self, script):
+        # таблицы фигур, сцена и шкала времени; окна не касается, поэтому
+        # документ можно собирать в фоновом потоке
+        self.width, self.height = script.width, script.height
+        self.store = FigureStore(script)
+        self.figuresCount = len(self.store)
+        self.revision += 1
+        self.compile()
         self.calc_duration()
-        self.parent.countStepsLabel.setText(str(self.duration))
-        self.parent.slider.setMaximum(self.duration)
+
+    def attach(self):
+        # показ собранного документа в окне, только из потока окна
+        self.invalidate_cache()
+        self.update_list()
+        self.update_slider()
 
     def calc_duration(self):
-        dur_cycle = 1
-        for x in self.dur_anims_cycle:
-            dur_cycle *= x // math.gcd(dur_cycle, x)
-        self.duration = max(self.dur_anims_no_cycle + [dur_cycle])
+        self.timeline = Timeline(self.store, self.loops)
+        self.duration = self.timeline.duration
+
+    def set_loops(self, loops):
+        self.loops = self.timeline.loops = loops
+        self.duration = self.timeline.duration
+        self.update_slider()
+        self.set_step(self.step)
+
+    def update_slider(self):
+        if not self.parent:
+            return
+        text = str(self.duration)
+        if self.loops is None and self.timeline.cyclic:
+            text += ' ∞'
+        self.parent.countStepsLabel.setText(text)
+        self.parent.slider.setMaximum(-(-self.duration // self.timeline.slider_scale()))
 
     def save_file(self, f):
-        print(self.width, self.height, file=f)
-        print(self.figuresCount, file=f)
-        for fig in self.figures:
-            fig.save_file(f)
+        f.write(self.save_text())
+
+    def save_text(self, progress=None):
+        # текст скрипта по столбцам FigureStore, кусками по SAVE_CHUNK фигур
+        store = self.store
+        kinds, x, y = store.kind.tolist(), store.x.tolist(), store.y.tolist()
+        width, height, angle = store.width.tolist(), store.height.tolist(), store.angle.tolist()
+        colors = [store.palette[color] for color in store.color.tolist()]
+        starts, counts = store.anim_start.tolist(), store.anim_count.tolist()
+        anim_kinds, anim_a, anim_b = store.anim_kind.tolist(), store.anim_a.tolist(), \
+            store.anim_b.tolist()
+        times = store.anim_time.tolist()
+        cycles = ['cycle' if cycle else '' for cycle in store.anim_cycle.tolist()]
+        eases = [store.easings[i] + ' ' if i else '' for i in store.anim_ease.tolist()]
+        parts = [f'{self.width} {self.height}\n{self.figuresCount}\n']
+        for chunk in range(0, self.figuresCount, SAVE_CHUNK):
+            if progress:
+                progress(chunk / self.figuresCount)
+            lines = []
+            for i in range(chunk, min(chunk + SAVE_CHUNK, self.figuresCount)):
+                kind = kinds[i]
+                if kind == 0:
+                    lines.append(f'rectangle {x[i]} {y[i]} {width[i]} {height[i]} {angle[i]} '
+                                 f'{colors[i]}')
+                elif kind == 1:
+                    lines.append(f'circle {x[i]} {y[i]} {width[i]} {colors[i]}')
+                else:
+                    lines.append(f'triangle {x[i]} {y[i]} {width[i]} {angle[i]} {colors[i]}')
+                lines.append(str(counts[i]))
+                for j in range(starts[i], starts[i] + counts[i]):
+                    anim = anim_kinds[j]
+                    if anim == 0:
+                        lines.append(f'move {anim_a[j]} {anim_b[j]} {times[j]} {eases[j]}{cycles[j]}')
+                    else:
+                        lines.append(f'{ANIM_NAMES[anim]} {anim_a[j]} {times[j]} '
+                                     f'{eases[j]}{cycles[j]}')
+            lines.append('')
+            parts.append('\n'.join(lines))
+        return ''.join(parts)
 
     def update_list(self):
-        self.parent.figures_widget = QWidget()
-        self.parent.scrollArea.setWidget(self.parent.figures_widget)
-        layout = QVBoxLayout()
-        self.btn_lis = []
-        for fig in self.figures:
-            btn = QPushButton(str(fig))
-            btn.figure = fig
-            btn.setCheckable(True)
-            btn.clicked.connect(self.parent.select_figure)
-            layout.addWidget(btn)
-            self.btn_list.append(btn)
-        spacer = QSpacerItem(0, 0, QSizePolicy.Fixed, QSizePolicy.MinimumExpanding)
-        layout.addItem(spacer)
-        self.parent.figures_widget.setLayout(layout)
-
-    def unset_figures(self):
-        for btn in self.btn_list:
-            btn.setChecked(False)
-
-    def draw(self):
-        for fig in self.figures:
-            fig.draw()
-        self.parent.currentStepLabel.setText(f'Текущий кадр: {self.step + 1}')
-        self.parent.slider.setValue(self.step + 1)
+        if not self.parent:
+            return
+        self.parent.figures_model.set_document(self)
+
+    def set_select_figure(self, fig):
+        self.select_figure = fig
+        self.invalidate_cache()
+
+    def compile(self):
+        self.scene = CompiledScene(self.store)
+        animated = self.scene.animated
+        kinds = self.store.kind[animated].tolist()
+        # что и чем рисовать для каждой анимированной фигуры, чтобы на кадр
+        # оставались только setTransform, setBrush/setPen и один вызов рисования
+        self.dynamic_shapes = [FIGURE_CLASSES[kind](self, i).shape()
+                               for i, kind in zip(animated.tolist(), kinds)]
+        self.dynamic_kinds = kinds
+        self.dynamic_calls = [DRAW_CALLS[kind] for kind in kinds]
+        self.dynamic_colors = self.store.color[animated].tolist()
+        # постоянные преобразования фигур, у которых все анимации закончились
+        self.final = [None] * len(self.scene)
+        self.states = StateCache(self.store, self.scene)
+        self.dynamic_index = None
+
+    def invalidate_cache(self):
+        self.batches = None
+        self.static_layer = None
+        self.static_index = None
+        self.painted = None
+        if self.frames is not None:
+            self.frames.clear()
+
+    def frame_state(self, step):
+        # матрицы и границы анимированных фигур на шаге, общие для всех, кому они нужны
+        state = self.states.get(step)
+        if state is None:
+            start = profiler.start() if profiler.enabled else 0
+            state = self.states.evaluate(step)
+            self.states.put(step, state)
+            if start:
+                profiler.stop('evaluate', start)
+        return state
+
+    def get_static_index(self):
+        if self.static_index is None:
+            static = np.flatnonzero(self.store.anim_count == 0)
+            boxes = self.store.local_bounds()[static]
+            boxes += np.stack([self.store.x[static], self.store.y[static]] * 2, -1)
+            boxes += [-1, -1, 1, 1]
+            self.static_index = (static, SpatialGrid(boxes, self.width, self.height))
+        return self.static_index
+
+    def get_dynamic_index(self, step):
+        if self.dynamic_index is None or self.dynamic_index[0] != step:
+            matrices, bounds = self.frame_state(step)
+            self.dynamic_index = (step, SpatialGrid(bounds, self.width, self.height))
+        return self.dynamic_index[1]
+
+    def figure_at(self, x, y):
+        # верхняя фигура под точкой холста: анимированные лежат поверх остальных
+        point = QPointF(x, y)
+        matrices, bounds = self.frame_state(self.step)
+        for slot in self.get_dynamic_index(self.step).query_point(x, y)[::-1]:
+            transform, invertible = to_qtransform(matrices[slot]).inverted()
+            fig = self.figures[int(self.scene.animated[slot])]
+            if invertible and fig.path().contains(transform.map(point)):
+                return fig
+        static, index = self.get_static_index()
+        for i in static[index.query_point(x, y)][::-1]:
+            fig = self.figures[int(i)]
+            if fig.path().contains(point - QPointF(fig.centerX, fig.centerY)):
+                return fig
+        return None
+
+    def dirty_region(self):
+        # Что перерисовать после смены шага или правки сцены: старые и новые границы
+        # фигур, у которых изменилось преобразование, и места правок. None - весь холст
+        edited, self.edited = np.reshape(self.edited, (-1, 4)), []
+        if self.painted is None:
+            return None
+        matrices, bounds = self.frame_state(self.step)
+        old_matrices, old_bounds = self.painted
+        changed = np.any(matrices != old_matrices, axis=(1, 2))
+        if not changed.any() and not len(edited):
+            return QRegion()
+        boxes = np.concatenate([old_bounds[changed], bounds[changed], edited])
+        return region_from_boxes(boxes, self.width, self.height)
+
+    def get_batches(self):
+        # Подряд идущие неанимированные фигуры одного цвета рисуются одним путём,
+        # порядок наложения фигур при этом сохраняется.
+        # Анимированные фигуры рисуются отдельно, в динамическом слое
+        if self.batches is None:
+            self.batches = []
+            store = self.store
+            last_color = None
+            for i in map(int, np.flatnonzero(store.anim_count == 0)):
+                fig = self.figures[i]
+                if fig == self.select_figure:
+                    self.batches.append(fig)
+                    last_color = None
+                    continue
+                color = store.color[i]
+                if color != last_color:
+                    path = QPainterPath()
+                    path.setFillRule(Qt.WindingFill)
+                    self.batches.append((store.brushes[color], store.pens[color], path))
+                    last_color = color
+                self.batches[-1][2].addPath(fig.path().translated(store.x[i], store.y[i]))
+        return self.batches
+
+    def get_static_layer(self):
+        # Неанимированные фигуры растеризуются один раз и дальше только копируются
+        ratio = self.widget.devicePixelRatioF() if self.widget else 1
+        size = QSize(round(self.width * ratio), round(self.height * ratio))
+        if self.static_layer is None or self.static_layer.size() != size:
+            self.static_layer = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            self.static_layer.setDevicePixelRatio(ratio)
+            self.static_layer.fill(Qt.transparent)
+            qp = QPainter(self.static_layer)
+            for item in self.get_batches():
+                if isinstance(item, Figure):
+                    item.draw(qp)
+                else:
+                    brush, pen, path = item
+                    qp.setBrush(brush)
+                    qp.setPen(pen)
+                    qp.drawPath(path)
+            qp.end()
+        return self.static_layer
+
+    def paint(self, qp, step=None, region=None):
+        # при частичной перерисовке рисуются только фигуры, задевающие region
+        if step is None:
+            step = self.step
+        matrices, bounds = self.frame_state(step)
+        start = profiler.start() if profiler.enabled else 0
+        qp.drawImage(0, 0, self.get_static_layer())
+        if start:
+            profiler.stop('blit', start)
+        if region is None:
+            slots = range(len(self.scene))
+        else:
+            slots = self.get_dynamic_index(step).query_region(region).tolist()
+        if profiler.enabled:
+            # каждый вызов рисования меряется отдельно, по типам фигур
+            timed = [profiler.timed(name, call) for name, call in zip(FIGURE_NAMES, DRAW_CALLS)]
+            start = profiler.start()
+            self.paint_dynamic(qp, step, matrices, slots,
+                               [timed[kind] for kind in self.dynamic_kinds])
+            profiler.stop('paint', start)
+        else:
+            self.paint_dynamic(qp, step, matrices, slots)
+        if step == self.step:
+            self.painted = (matrices, bounds)
+
+    def dynamic_slot(self, fig):
+        return -1 if fig is None else self.slot_of(fig.index)
+
+    def slot_of(self, index):
+        # место фигуры среди анимированных или -1
+        animated = self.scene.animated
+        slot = int(np.searchsorted(animated, index))
+        return slot if slot < len(animated) and animated[slot] == index else -1
+
+    def dynamic_view(self):
+        # Всё, что читает paint_dynamic, одним набором. Правка не меняет эти
+        # списки на месте, а заменяет их, поэтому набор, взятый в потоке окна,
+        # остаётся согласованным, пока фоновый поток по нему рисует
+        return (self.revision, self.states, self.scene.finish, self.dynamic_shapes,
+                self.dynamic_colors, self.dynamic_calls, self.final,
+                self.dynamic_slot(self.select_figure))
+
+    def paint_dynamic(self, qp, step, matrices, slots, calls=None, view=None):
+        # Каждой фигуре ставится её итоговое преобразование целиком, без save/restore.
+        # Вызывается и из фонового потока, поэтому состояние документа не меняет,
+        # кроме заполнения списка final
+        store = self.store
+        brushes, pens = store.brushes, store.pens
+        _, _, finish, shapes, colors, dynamic_calls, final, selected = view or self.dynamic_view()
+        calls = calls or dynamic_calls
+        finished = (finish <= step).tolist()
+        # шесть чисел QTransform для каждой фигуры одним списком
+        rows = matrices[:, [0, 1, 0, 1, 0, 1], [0, 0, 1, 1, 2, 2]].tolist()
+        last_color = None
+        for slot in slots:
+            if finished[slot]:
+                transform = final[slot]
+                if transform is None:
+                    transform = final[slot] = QTransform(*rows[slot])
+            else:
+                transform = QTransform(*rows[slot])
+            qp.setTransform(transform)
+            color = colors[slot]
+            if slot == selected:
+                qp.setBrush(store.selected_brushes[color])
+                qp.setPen(pens[color])
+                last_color = None
+            elif color != last_color:
+                qp.setBrush(brushes[color])
+                qp.setPen(pens[color])
+                last_color = color
+            calls[slot](qp, shapes[slot])
+        qp.resetTransform()
+
+    def render_frame(self, step, layer, view=None):
+        # Кадр без фона для кэша кадров. Рисуется и в фоновом потоке по набору
+        # view из dynamic_view, поэтому не трогает запомненное состояние документа
+        view = view or self.dynamic_view()
+        frame = QImage(layer.size(), QImage.Format_ARGB32_Premultiplied)
+        frame.setDevicePixelRatio(layer.devicePixelRatio())
+        frame.fill(Qt.transparent)
+        qp = QPainter(frame)
+        qp.drawImage(0, 0, layer)
+        self.paint_dynamic(qp, step, view[1].state(step)[0], range(len(view[3])), view=view)
+        qp.end()
+        return frame
+
+    def render_image(self, step=None):
+        # кадр целиком, без виджета: белый фон, как у холста в окне
+        image = QImage(self.width, self.height, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.white)
+        qp = QPainter(image)
+        self.paint(qp, step)
+        qp.end()
+        return image
+
+    def draw(self, region=None):
+        qp = QPainter()
+        qp.begin(self.widget)
+        frame = None
+        # кадры между шагами в кэш не кладутся
+        if self.frames is not None and self.step == int(self.step):
+            frame = self.frames.get(self.timeline.canonical(self.step))
+        if frame is None:
+            start = time.perf_counter()
+            self.paint(qp, region=region)
+            self.paint_ms = (time.perf_counter() - start) * 1000
+        else:
+            self.painted = self.frame_state(self.step)
+            start = profiler.start() if profiler.enabled else 0
+            qp.drawImage(0, 0, frame)
+            if start:
+                profiler.stop('blit', start)
+        qp.end()
+
+    def prefetch_steps(self):
+        # следующие кадры в ту сторону и с тем шагом, как двигались последний раз
+        if self.paint_ms < PREFETCH_MIN_MS or self.stride != int(self.stride):
+            return []
+        # кадры повторяются с периодом циклов, поэтому в кэше они по первому периоду
+        stride = int(self.stride)
+        steps = range(self.step + stride, self.step + stride * (PREFETCH_FRAMES + 1), stride)
+        steps = [self.timeline.wrap(step) for step in steps]
+        steps = [self.timeline.canonical(step) for step in steps if 0 <= step < self.duration]
+        return list(dict.fromkeys(steps))
 
     def set_step(self, step):
-        step = int(step)
+        # шаг может быть дробным, тогда фигуры стоят между положениями соседних шагов
+        if step == int(step):
+            step = int(step)
+        if step != self.step:
+            self.stride = step - self.step
         if step < 0:
             step = 0
         elif step >= self.duration:
-            step = self.duration - 1
-            self.parent.is_draw = False
+            # при бесконечном повторе шаг возвращается в первый период
+            step = self.timeline.wrap(step)
+            if step >= self.duration:
+                step = self.duration - 1
+                if self.parent:
+                    self.parent.is_draw = False
         self.step = step
 
+    # Правка сцены без перезагрузки документа: меняются строки таблиц одной фигуры,
+    # её строка в списке, её строки в сохранённых состояниях и место на холсте,
+    # где она была и стала. Шаг и показ анимации при этом не сбрасываются
+
+    def add_figure(self, name, *values, color='black', index=None):
+        # числа как в строке скрипта: rectangle x y ширина высота угол, circle x y радиус,
+        # triangle x y радиус угол. Фигура добавляется без анимаций, по умолчанию в конец
+        if name not in FIGURE_ARGS:
+            raise ValueError(f'неизвестная фигура «{name}»')
+        if len(values) != FIGURE_ARGS[name]:
+            raise ValueError(f'{name}: ожидалось чисел: {FIGURE_ARGS[name]}, '
+                             f'получено: {len(values)}')
+        if index is None:
+            index = self.figuresCount
+        elif not 0 <= index <= self.figuresCount:
+            raise IndexError(index)
+        if name == 'rectangle':
+            x, y, width, height, angle = values
+        elif name == 'circle':
+            (x, y, width), height, angle = values, 0, 0
+        else:
+            (x, y, width, angle), height = values, 0
+        model = self.list_model()
+        if model:
+            model.begin_insert_figures(index, 1)
+        self.store.insert_figure(index, FIGURE_KINDS[name], x, y, width, height, angle, color)
+        self.figuresCount += 1
+        self.scene.shift(index, 1)
+        self.shift_selection(index, 1)
+        if model:
+            model.end_insert_figures()
+        box = self.static_box(index)
+        self.update_static([box])
+        self.finish_edit([box])
+        return index
+
+    def remove_figure(self, index):
+        self.check_figure(index)
+        slot = self.slot_of(index)
+        box = self.figure_box(index)
+        model = self.list_model()
+        if model:
+            model.begin_remove_figures(index, 1)
+        self.timeline.remove(*self.store.remove_figure(index))
+        self.figuresCount -= 1
+        self.shift_selection(index, -1)
+        if slot < 0:
+            self.scene.shift(index, -1)
+            self.update_static([box])
+        else:
+            # неанимированные фигуры не менялись, но их номера сдвинулись
+            self.update_static([])
+            self.update_dynamic(slot, 1, 0, index)
+        if model:
+            model.end_remove_figures()
+        self.finish_edit([box])
+
+    def change_figure(self, index, **values):
+        # x, y, width, height, angle или color
+        self.check_figure(index)
+        unknown = set(values) - set(FIGURE_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f'нет такого свойства фигуры: {", ".join(sorted(unknown))}')
+        self.edit_figure(index, lambda: self.store.set_figure(index, **values))
+        model = self.list_model()
+        if model:
+            model.update_figure(index)
+
+    def add_anim(self, figure, name, *values, cycle=False, ease=LINEAR, position=None):
+        # числа как в строке скрипта: move x y время, rotate угол время, scale множитель время;
+        # по умолчанию анимация добавляется последней
+        self.check_figure(figure)
+        if name not in ANIM_ARGS:
+            raise ValueError(f'неизвестная анимация «{name}»')
+        if len(values) != ANIM_ARGS[name]:
+            raise ValueError(f'{name}: ожидалось чисел: {ANIM_ARGS[name]}, '
+                             f'получено: {len(values)}')
+        count = int(self.store.anim_count[figure])
+        if position is None:
+            position = count
+        elif not 0 <= position <= count:
+            raise IndexError(position)
+        *targets, time = values
+        if len(targets) == 1:
+            targets.append(0)
+        self.edit_figure(figure, lambda: self.store.insert_anim(
+            figure, position, ANIM_KINDS[name], *targets, int(time), cycle, ease))
+
+    def remove_anim(self, figure, position):
+        self.check_anim(figure, position)
+        self.edit_figure(figure, lambda: self.store.remove_anim(figure, position))
+
+    def change_anim(self, figure, position, **values):
+        # a, b (цели анимации, как числа в скрипте), time, cycle или ease
+        self.check_anim(figure, position)
+        unknown = set(values) - {'a', 'b', 'time', 'cycle', 'ease'}
+        if unknown:
+            raise ValueError(f'нет такого свойства анимации: {", ".join(sorted(unknown))}')
+        self.edit_figure(figure, lambda: self.store.set_anim(figure, position, **values))
+
+    def check_figure(self, index):
+        if not 0 <= index < self.figuresCount:
+            raise IndexError(index)
+
+    def check_anim(self, figure, position):
+        self.check_figure(figure)
+        if not 0 <= position < self.store.anim_count[figure]:
+            raise IndexError(position)
+
+    def list_model(self):
+        # список фигур в окне, если он показывает этот документ
+        if self.parent and self.parent.figures_model.document is self:
+            return self.parent.figures_model
+        return None
+
+    def static_box(self, index):
+        box = self.store.local_bounds([index])[0]
+        x, y = self.store.x[index], self.store.y[index]
+        return box + [x - 1, y - 1, x + 1, y + 1]
+
+    def figure_box(self, index):
+        # место фигуры на холсте, у анимированной - на текущем шаге
+        slot = self.slot_of(index)
+        return self.static_box(index) if slot < 0 else self.frame_state(self.step)[1][slot]
+
+    def shift_selection(self, index, delta):
+        fig = self.select_figure
+        if fig is None or fig.index < index:
+            return
+        if delta < 0 and fig.index == index:
+            self.select_figure = None
+        else:
+            self.select_figure = self.figures[fig.index + delta]
+
+    def edit_figure(self, index, change):
+        # Правка фигуры, номер которой не меняется: change правит таблицы.
+        # Длительность пересчитывается по счётчикам шкалы, без прохода по всем анимациям
+        store = self.store
+        old_slot = self.slot_of(index)
+        old_box = self.figure_box(index)
+        anims = store.anims(index)
+        old_anims = store.anim_time[anims].copy(), store.anim_cycle[anims].copy()
+        change()
+        anims = store.anims(index)
+        self.timeline.remove(*old_anims)
+        self.timeline.add(store.anim_time[anims], store.anim_cycle[anims])
+        animated = anims.stop > anims.start
+        if old_slot >= 0 or animated:
+            slot = int(np.searchsorted(self.scene.animated, index))
+            self.update_dynamic(slot, int(old_slot >= 0), int(animated), index)
+        boxes = [old_box, self.figure_box(index)]
+        if old_slot < 0 or not animated:
+            # фигура была или стала неанимированной
+            self.update_static(boxes)
+        self.finish_edit(boxes)
+
+    def update_dynamic(self, slot, removed, added, index):
+        # Сцена собирается заново из массивов, а в списках для отрисовки
+        # и в сохранённых состояниях меняются только строки фигуры index.
+        # Списки не правятся на месте, а заменяются: их читает фоновый поток
+        scene = CompiledScene(self.store)
+        self.states = self.states.splice(self.store, scene, slot, removed, added)
+        self.scene = scene
+        kinds = self.store.kind[index:index + added].tolist()
+
+        def spliced(values, new):
+            return values[:slot] + new + values[slot + removed:]
+
+        self.dynamic_shapes = spliced(self.dynamic_shapes,
+                                      [FIGURE_CLASSES[kind](self, index).shape() for kind in kinds])
+        self.dynamic_kinds = spliced(self.dynamic_kinds, kinds)
+        self.dynamic_calls = spliced(self.dynamic_calls, [DRAW_CALLS[kind] for kind in kinds])
+        self.dynamic_colors = spliced(self.dynamic_colors,
+                                      self.store.color[index:index + added].tolist())
+        self.final = spliced(self.final, [None] * added)
+        # остальные фигуры на текущем шаге стоят там же, где их нарисовали
+        if self.painted is not None:
+            self.painted = self.frame_state(self.step)
+
+    def update_static(self, boxes):
+        # В готовом статичном слое перерисовывается только место правки:
+        # оно очищается, и в нём заново рисуются задевающие его фигуры
+        self.batches = None
+        self.static_index = None
+        if self.static_layer is None or not boxes:
+            return
+        region = region_from_boxes(boxes, self.width, self.height)
+        if region is None:
+            self.static_layer = None
+            return
+        # рисуется на копии: старый слой может ещё читать фоновый поток
+        layer = QImage(self.static_layer)
+        qp = QPainter(layer)
+        qp.setClipRegion(region)
+        qp.setCompositionMode(QPainter.CompositionMode_Source)
+        qp.fillRect(0, 0, self.width, self.height, Qt.transparent)
+        qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        static, index = self.get_static_index()
+        for i in static[index.query_region(region)].tolist():
+            self.figures[i].draw(qp)
+        qp.end()
+        self.static_layer = layer
+
+    def finish_edit(self, boxes):
+        self.revision += 1
+        self.dynamic_index = None
+        if self.frames is not None:
+            self.frames.clear()
+        self.edited += boxes
+        self.duration = self.timeline.duration
+        # шаг, оказавшийся за концом сократившейся анимации, встаёт на последний
+        self.step = min(self.timeline.wrap(self.step), self.duration - 1)
+        self.update_slider()
+        if self.parent and self.parent.document is self:
+            self.parent.update_canvas()
+
+
+class FigureViews:
+    # Список фигур документа: объекты-представления создаются по запросу
+    def __init__(self, document):
+        self.document = document
+
+    def __len__(self):
+        return len(self.document.store)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return FIGURE_CLASSES[self.document.store.kind[index]](self.document, index)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 
 class Animation:
-    def __init__(self, parent, time, cycle=''):
+    # Представление строки таблицы анимаций из FigureStore
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent, index):
         self.parent = parent
-        self.cycle = cycle
-        self.time = int(time)
-        if self.cycle:
-            self.parent.parent.dur_anims_cycle.append(self.time * 2)
-        else:
-            self.parent.parent.dur_anims_no_cycle.append(self.time)
+        self.index = index
+
+    @property
+    def store(self):
+        return self.parent.parent.store
+
+    @property
+    def time(self):
+        return int(self.store.anim_time[self.index])
+
+    @property
+    def cycle(self):
+        return 'cycle' if self.store.anim_cycle[self.index] else ''
+
+    @property
+    def ease(self):
+        return self.store.easings[self.store.anim_ease[self.index]]
 
     def coeff(self):
+        step = self.parent.parent.step
+        time = self.time
         if self.cycle:
-            n = self.parent.parent.step // self.time
+            n = step // time
             if n % 2:  # Обратный ход
-                return 1 - (self.parent.parent.step % self.time) / self.time
+                coeff = 1 - (step % time) / time
             else:  # Прямой ход
-                return (self.parent.parent.step % self.time) / self.time
+                coeff = (step % time) / time
         else:
-            return min(1, self.parent.parent.step / self.time)
+            coeff = min(1, step / time)
+        return float(ease(self.ease, coeff))
 
 
 class Move(Animation):
-    def __init__(self, parent, destX, destY, time, cycle=''):
-        super().__init__(parent, time, cycle)
-        self.destX = float(destX)
-        self.destY = float(destY)
+    __slots__ = ()
 
-    def draw(self):
-        x = (self.destX - self.parent.centerX) * self.coeff()
-        y = (self.destY - self.parent.centerY) * self.coeff()
-        self.parent.qp.translate(x, y)
+    @property
+    def destX(self):
+        return float(self.store.anim_a[self.index])
 
-    def save_file(self, f):
-        print('move', self.destX, self.destY, self.time, self.cycle, file=f)
+    @property
+    def destY(self):
+        return float(self.store.anim_b[self.index])
+
+    def draw(self, qp):
+        coeff = self.coeff()
+        qp.translate((self.destX - self.parent.centerX) * coeff,
+                     (self.destY - self.parent.centerY) * coeff)
 
 
 class Rotate(Animation):
-    def __init__(self, parent, angle, time, cycle=''):
-        super().__init__(parent, time, cycle)
-        self.angle = float(angle)
+    __slots__ = ()
 
-    def draw(self):
-        self.parent.qp.rotate(self.parent.angle + self.angle * self.coeff())
+    @property
+    def angle(self):
+        return float(self.store.anim_a[self.index])
 
-    def save_file(self, f):
-        print('rotate', self.angle, self.time, self.cycle, file=f)
+    def draw(self, qp):
+        qp.rotate(self.parent.angle + self.angle * self.coeff())
 
 
 class Scale(Animation):
-    def __init__(self, parent, destScale, time, cycle=''):
-        super().__init__(parent, time, cycle)
-        self.destScale = float(destScale)
+    __slots__ = ()
 
-    def draw(self):
-        self.parent.qp.scale(self.destScale * self.coeff(), self.destScale * self.coeff())
+    @property
+    def destScale(self):
+        return float(self.store.anim_a[self.index])
 
-    def save_file(self, f):
-        print('scale', self.destScale, self.time, self.cycle, file=f)
+    def draw(self, qp):
+        scale = self.destScale * self.coeff()
+        qp.scale(scale, scale)
 
 
 class Figure:
-    def __init__(self, parent, centerX, centerY, color, angle):
+    # Представление строки FigureStore для списка фигур и отрисовки без сцены
+    __slots__ = ('parent', 'index')
 
-        self.qp = None
+    def __init__(self, parent, index):
         self.parent = parent
-        self.centerX = centerX
-        self.centerY = centerY
-        self.color = color
-        self.anims = []
-        self.angle = angle
-
-    def draw_start(self):
-        self.qp = QPainter()
-        if self.parent.widget:
-            self.qp.begin(self.parent.widget)
-        if self is self.parent.select_figure:
-            color = QColor(self.color)
-            rgb = color.getRgb()[:-1]
-            rgb = [255 - x for x in rgb]
-            self.qp.setBrush(QColor(*rgb, 255))
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, Figure) and other.parent is self.parent and \
+            other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.parent), self.index))
+
+    @property
+    def store(self):
+        return self.parent.store
+
+    @property
+    def centerX(self):
+        return float(self.store.x[self.index])
+
+    @property
+    def centerY(self):
+        return float(self.store.y[self.index])
+
+    @property
+    def angle(self):
+        return float(self.store.angle[self.index])
+
+    @property
+    def color(self):
+        return self.store.palette[self.store.color[self.index]]
+
+    @property
+    def anims(self):
+        store = self.store
+        start = int(store.anim_start[self.index])
+        return [ANIM_CLASSES[store.anim_kind[i]](self, i)
+                for i in range(start, start + int(store.anim_count[self.index]))]
+
+    def draw_start(self, qp):
+        qp.save()
+        store = self.store
+        color = store.color[self.index]
+        if self == self.parent.select_figure:
+            qp.setBrush(store.selected_brushes[color])
         else:
-            self.qp.setBrush(QColor(self.color))
-        self.qp.setPen(QColor(self.color))
-        self.qp.translate(self.centerX, self.centerY)
+            qp.setBrush(store.brushes[color])
+        qp.setPen(store.pens[color])
+        qp.translate(self.centerX, self.centerY)
         for anim in self.anims:
-            anim.draw()
+            anim.draw(qp)
 
-    def draw_end(self):
-        self.qp.end()
+    def draw_end(self, qp):
+        qp.restore()
 
-    def add_anim_str(self, s):
-        name, *s = s.split()
-        if name == 'move':
-            self.add_anim(Move(self, *s))
-        elif name == 'rotate':
-            self.add_anim(Rotate(self, *s))
-        elif name == 'scale':
-            self.add_anim(Scale(self, *s))
+    def draw(self, qp):
+        self.draw_start(qp)
+        self.draw_shape(qp)
+        self.draw_end(qp)
 
-    def add_anim(self, anim):
-        self.anims.append(anim)
 
-    def save_file(self, f):
-        print(len(self.anims), file=f)
-        for anim in self.anims:
-            anim.save_file(f)
+class Rectangle(Figure):
+    __slots__ = ()
 
+    @property
+    def width(self):
+        return float(self.store.width[self.index])
 
-class Rectangle(Figure):
-    def __init__(self, centerX, centerY, width, height, angle, color, parent):
-        super().__init__(parent, centerX, centerY, color, angle)
-        self.width = width
-        self.height = height
-        self.angle = angle
+    @property
+    def height(self):
+        return float(self.store.height[self.index])
 
     def __str__(self):
         return 'Прямоугольник'
 
-    def draw(self):
-        self.draw_start()
-        x = -self.width / 2
-        y = -self.height / 2
-        self.qp.drawRect(x, y, self.width, self.height)
-        self.draw_end()
+    def rect(self):
+        width, height = self.width, self.height
+        return QRectF(-width / 2, -height / 2, width, height)
 
-    def save_file(self, f):
-        print('rectangle', self.centerX, self.centerY, self.width, self.height, self.angle,
-              self.color, file=f)
-        super().save_file(f)
+    def path(self):
+        path = QPainterPath()
+        path.addRect(self.rect())
+        return path
+
+    def shape(self):
+        return self.rect()
+
+    def draw_shape(self, qp):
+        qp.drawRect(self.rect())
 
 
 class Circle(Figure):
-    def __init__(self, centerX, centerY, radius, color, parent):
-        super().__init__(parent, centerX, centerY, color, 0)
-        self.radius = radius
+    __slots__ = ()
+
+    @property
+    def radius(self):
+        return float(self.store.width[self.index])
 
     def __str__(self):
         return 'Круг'
 
-    def draw(self):
-        self.draw_start()
-        self.qp.drawEllipse(0, 0, self.radius, self.radius)
-        self.draw_end()
+    def path(self):
+        path = QPainterPath()
+        path.addEllipse(self.shape())
+        return path
 
-    def save_file(self, f):
-        print('circle', self.centerX, self.centerY, self.radius, self.color, file=f)
-        super().save_file(f)
+    def shape(self):
+        return QRectF(0, 0, self.radius, self.radius)
+
+    def draw_shape(self, qp):
+        qp.drawEllipse(self.shape())
 
 
 class Triangle(Figure):
-    def __init__(self, centerX, centerY, radius, angle, color, parent):
-        super().__init__(parent, centerX, centerY, color, 0)
-        self.radius = radius
-        self.angle = angle
-        self.point1 = (0, -self.radius)
-        self.x = self.radius * CONST_3_2_PI
-        self.point2 = (self.x, self.radius / 2)
-        self.point3 = (-self.x, self.radius / 2)
+    __slots__ = ()
+
+    @property
+    def radius(self):
+        return float(self.store.width[self.index])
 
     def __str__(self):
         return 'Треугольник'
 
-    def draw(self):
-        self.draw_start()
-        path = QPainterPath()
-        path.moveTo(*self.point3)
-        path.lineTo(*self.point1)
-        path.lineTo(*self.point2)
-        path.lineTo(*self.point3)
-        self.qp.drawPath(path)
-        self.draw_end()
+    def path(self):
+        return triangle_path(self.radius)
 
-    def save_file(self, f):
-        print('triangle', self.centerX, self.centerY, self.radius, self.angle, self.color, file=f)
-        super().save_file(f)
+    def shape(self):
+        return self.path()
+
+    def draw_shape(self, qp):
+        qp.drawPath(self.path())
+
+
+@functools.lru_cache(maxsize=4096)
+def triangle_path(radius):
+    # в сценах обычно немного разных размеров треугольников, а QPainterPath
+    # копируется при изменении, так что один путь можно отдавать всем
+    x = radius * CONST_3_2_PI
+    path = QPainterPath()
+    path.moveTo(-x, radius / 2)
+    path.lineTo(0, -radius)
+    path.lineTo(x, radius / 2)
+    path.lineTo(-x, radius / 2)
+    return path
+
+
+FIGURE_CLASSES = (Rectangle, Circle, Triangle)
+ANIM_CLASSES = (Move, Rotate, Scale)
+DRAW_CALLS = (QPainter.drawRect, QPainter.drawEllipse, QPainter.drawPath)
+
+
+class FigureListModel(QAbstractListModel):
+    # Список фигур документа для QListView: строки создаются только для
+    # видимой части списка, а фигуры берутся из документа по номеру
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = None
+        # rowCount представление вызывает на каждую строку, поэтому число запоминается
+        self.count = 0
+
+    def set_document(self, document):
+        self.beginResetModel()
+        self.document = document
+        self.count = len(document.figures)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.document.figures[index.row()])
+        return None
+
+    def figure(self, index):
+        return self.document.figures[index.row()] if index.isValid() else None
+
+    # вокруг добавления и удаления фигур в документе, как begin/endInsertRows в Qt
+    def begin_insert_figures(self, first, count):
+        self.beginInsertRows(QModelIndex(), first, first + count - 1)
+
+    def end_insert_figures(self):
+        self.count = len(self.document.figures)
+        self.endInsertRows()
+
+    def begin_remove_figures(self, first, count):
+        self.beginRemoveRows(QModelIndex(), first, first + count - 1)
+
+    def end_remove_figures(self):
+        self.count = len(self.document.figures)
+        self.endRemoveRows()
+
+    def update_figure(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class Playback:
+    # Шаг анимации определяется прошедшим реальным временем, а не числом
+    # срабатываний таймера: если кадр рисуется дольше, промежуточные шаги пропускаются
+    def __init__(self, interval, speed=DEFAULT_SPEED):
+        self.interval = interval
+        self.speed = speed
+        self.clock = QElapsedTimer()
+        self.running = False
+        self.rest = 0
+        self.dropped = 0
+        self.frames = 0
+        self.fps = 0
+        self.fps_clock = QElapsedTimer()
+        self.fps_clock.start()
+        self.fps_frames = 0
+
+    def advance(self, running):
+        # сколько шагов надо сделать к этому моменту
+        if not running:
+            self.running = False
+            return 0
+        if not self.running:
+            self.running = True
+            self.rest = 0
+            self.clock.start()
+            return 0
+        elapsed = self.clock.nsecsElapsed() / 1e9
+        self.clock.start()
+        # кадры, которые не успели показать к очередному обновлению экрана
+        missed = round(elapsed * 1000 / self.interval) - 1
+        if missed > 0:
+            self.dropped += missed
+        steps = elapsed * self.speed + self.rest
+        if self.speed * self.interval < 1000:
+            # меньше шага за обновление экрана: время идёт дробными шагами,
+            # и фигуры двигаются плавно, а не раз в несколько кадров
+            self.rest = 0
+            return steps
+        count = int(steps)
+        self.rest = steps - count
+        return count
+
+    def set_speed(self, speed):
+        self.speed = min(max(speed, 1), MAX_SPEED)
+
+    def frame_painted(self):
+        self.frames += 1
+        self.fps_frames += 1
+        elapsed = self.fps_clock.elapsed()
+        if elapsed >= 1000:
+            self.fps = self.fps_frames * 1000 / elapsed
+            self.fps_frames = 0
+            self.fps_clock.start()
+            return True
+        return False
+
+
+def load_ui_file(widget, name):
+    # Разбор .ui при запуске. Иконки кнопок записаны в нём путями ресурсов :/icons/...,
+    # они есть после импорта собранного icons_rc, а без него берутся из файлов icons/
+    from PyQt5 import uic
+    try:
+        importlib.import_module('icons_rc')
+    except Exception:
+        with open(f'{name}.ui', 'r', encoding='utf-8') as f:
+            uic.loadUi(io.StringIO(f.read().replace(':/icons/', 'icons/')), widget)
+        return
+    uic.loadUi(f'{name}.ui', widget)
+
+
+def setup_ui(widget, name):
+    # Интерфейс из модуля, который build_ui собирает из name.ui (и пересобирает,
+    # если .ui новее). Если собрать или импортировать модуль не вышло по любой
+    # причине, например папка только для чтения или модуль испорчен, .ui
+    # разбирается при каждом запуске, как раньше
+    try:
+        if not COMPILED_UI:
+            raise ImportError(name)
+        build_ui.build()
+        module = importlib.import_module(f'ui_{name}')
+    except Exception:
+        load_ui_file(widget, name)
+        return
+    ui = next(value for key, value in vars(module).items() if key.startswith('Ui_'))()
+    ui.setupUi(widget)
+    # виджеты доступны как атрибуты окна, так же как после uic.loadUi
+    vars(widget).update(vars(ui))
 
 
 class Form(QMainWindow):
-    def __init__(self):
+    def __init__(self, canvas=DEFAULT_CANVAS):
         super().__init__()
-        uic.loadUi('proekt.ui', self)
+        setup_ui(self, 'proekt')
+        self.canvas = canvas
         self.file_name = None
+        self.figures_model = FigureListModel(self)
+        self.prefetcher = Prefetcher()
+        self.files = FileJobs(self)
+        # задачи открытия и сохранения, чей ход показывается под настройками
+        self.open_job = None
+        self.file_jobs = {}
+        self.loops = LOOP_CHOICES[0]
         self.document = Document(self)
         self.is_animations = [False, False, False]
         self.is_figures = [True, False, False]
         self.setWindowIcon(QIcon('ikona.jpg'))
-        self.speed = DEFAULT_SPEED
         self.is_draw = False
+        # буквы и окна справки, примеров и истории создаются при первом обращении
+        self.text_engine = None
+        self.help_form = None
+        self.examples_form = None
+        self.history_form = None
         self.history_list = []
         try:
             with open('history.log', 'r', encoding='utf-8') as f:
@@ -307,8 +1076,18 @@ class Form(QMainWindow):
         self.init_ui()
 
     def init_ui(self):
-        self.widget = QWidget()
-        self.widget.setStyleSheet(BACK_AREA)
+        # модуль OpenGL нужен только для холста на OpenGL
+        glcanvas = importlib.import_module('glcanvas') if self.canvas == 'gl' else None
+        if glcanvas and glcanvas.gl_available():
+            # кадр рисует GLCanvas.paintGL, отсечение по областям ему не нужно
+            self.widget = glcanvas.GLCanvas(self)
+        else:
+            self.widget = QWidget()
+            self.widget.setStyleSheet(BACK_AREA)
+            self.widget.paintEvent = self.paint_canvas
+            self.widget.resizeEvent = lambda event: self.document.invalidate_cache()
+            if self.canvas == 'gl':
+                self.show_error('OpenGL 4.1 недоступен, холст рисуется без него')
         self.document.set_widget(self.widget)
         self.scrollArea_3.setWidget(self.widget)
         self.saveButton.clicked.connect(self.save)
@@ -330,14 +1109,27 @@ class Form(QMainWindow):
         self.prevStepButton.clicked.connect(self.prev_step)
         self.nextStepButton.clicked.connect(self.next_step)
         self.slider.valueChanged.connect(self.change_step)
+        self.loopsComboBox.currentIndexChanged.connect(self.set_loops)
+        self.cancelFileButton.clicked.connect(self.cancel_file)
+        self.files.progress.connect(self.file_progress)
+        self.files.finished.connect(self.file_finished)
+        self.files.failed.connect(self.file_failed)
         self.startButton.clicked.connect(self.start)
         self.pauseButton.clicked.connect(self.pause)
         self.upSpeedButton.clicked.connect(self.speed_up)
         self.downSpeedButton.clicked.connect(self.speed_down)
-        self.widget.paintEvent = lambda event: form.document.draw()
+        self.widget.mousePressEvent = self.click_canvas
+        self.figuresList.setModel(self.figures_model)
+        self.figuresList.selectionModel().selectionChanged.connect(self.select_figure)
+        # таймер срабатывает с частотой обновления экрана
+        screen = QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 0
         self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.drawing)
-        self.timer.start(self.speed)
+        self.playback = Playback(round(1000 / (refresh_rate or DEFAULT_REFRESH_RATE)))
+        self.timer.start(self.playback.interval)
+        self.update_fps_label()
 
     def save(self):
         if self.file_name:
@@ -351,14 +1143,11 @@ class Form(QMainWindow):
         if f_as_name:
             self.save_to_file(f_as_name)
 
-    def save_to_file(self, file_name):
+    def save_to_file(self, file_name, background=True):
         if file_name:
             self.file_name = file_name
-            try:
-                with open(file_name, 'w') as f:
-                    self.document.save_file(f)
-            except:
-                QErrorMessage().showMessage('Ошибка сохранения')
+            job = self.watch_file('save', file_name)
+            self.files.start(job, save_document, self.document, file_name, background=background)
 
     def skrin(self):
         # изображение результата работы программы
@@ -375,23 +1164,29 @@ class Form(QMainWindow):
     def clean_all(self):
         # очищение строки текста и прекращение показа анимации
         self.textEdit.setText('')
-        self.document = Document(self)
-        self.document.set_widget(self.widget)
+        self.cancel_open()
+        self.set_document(Document(self))
 
     def history(self):
         # вывод списка в виде таблице время/текст анимации
-        self.history_form = HistoryForm(self)
-        self.history_form.show()
+        if self.history_form is None:
+            self.history_form = HistoryForm(self)
+        else:
+            self.history_form.update_list()
+        show_window(self.history_form)
 
     def example(self):
         # окошко выбора из 10 Сашиных анимаций с пойманным моментом отображения текста
-        self.examples_from = ExamplesForm(self)
-        self.examples_from.show()
+        if self.examples_form is None:
+            self.examples_form = ExamplesForm(self)
+        self.examples_form.update_list()
+        show_window(self.examples_form)
 
     def spravka(self):
         # справка = реадми  указания по работе с приложением  открывается отдельное окошко с текстом
-        self.help_form = HelpForm()
-        self.help_form.show()
+        if self.help_form is None:
+            self.help_form = HelpForm()
+        show_window(self.help_form)
 
     def animated(self):
         text = self.textEdit.toPlainText().strip().upper()
@@ -399,31 +1194,125 @@ class Form(QMainWindow):
             if text in self.history_list:
                 self.history_list.remove(text)
             self.history_list.append(text)
-            self.history_list = self.history_list[:10]
+            self.history_list = self.history_list[-10:]
             try:
                 with open('history.log', 'w', encoding='utf-8') as f:
                     for s in self.history_list:
                         print(s, file=f)
             except:
                 pass
-            print(text)
+            self.show_text(text)
+
+    def show_text(self, text):
+        # сцена из фигур букв с выбранными типами фигур и анимаций
+        self.file_name = None
+        self.is_draw = False
+        self.cancel_open()
+        if self.text_engine is None:
+            self.text_engine = TextEngine()
+        document = Document(self)
+        script = self.text_engine.layout(text, self.is_figures, self.is_animations,
+                                         document.width, document.height)
+        document.build(script)
+        self.set_document(document)
+        missing = self.text_engine.missing(text)
+        if missing:
+            self.show_error(f'Нет фигур для букв: {" ".join(missing)}')
+        elif any(self.is_animations):
+            self.is_draw = True
 
     def open(self):
         f_as_name, _ = QFileDialog.getOpenFileName(self)
         if f_as_name:
             self.open_file(f_as_name)
 
-    def open_file(self, file_name):
+    def open_file(self, file_name, background=True):
+        # Скрипт читается и собирается в фоновом потоке, а текущий документ
+        # тем временем показывается дальше и заменяется готовым новым целиком
+        self.cancel_open()
+        self.load_start = profiler.start() if profiler.enabled else 0
+        self.open_job = self.watch_file('open', file_name)
+        self.files.start(self.open_job, open_document, Document(self), file_name, SCRIPT_CACHE,
+                         background=background)
+
+    def cancel_open(self):
+        # новый документ заменяет открываемый, его загрузка больше не нужна
+        if self.open_job is not None:
+            self.files.cancel(self.open_job)
+            self.file_jobs.pop(self.open_job, None)
+            self.open_job = None
+            self.update_file_progress()
+
+    def watch_file(self, kind, file_name):
+        job = self.files.new_job()
+        self.file_jobs[job] = [kind, file_name, 0]
+        self.update_file_progress()
+        return job
+
+    def file_progress(self, job, percent):
+        if job in self.file_jobs:
+            self.file_jobs[job][2] = percent
+            self.update_file_progress()
+
+    def update_file_progress(self):
+        # полоса показывает последнюю из идущих задач
+        self.fileProgressBar.setVisible(bool(self.file_jobs))
+        self.cancelFileButton.setVisible(bool(self.file_jobs))
+        if self.file_jobs:
+            kind, file_name, percent = self.file_jobs[max(self.file_jobs)]
+            self.fileProgressBar.setValue(percent)
+            self.fileProgressBar.setToolTip(('Открытие ' if kind == 'open' else 'Сохранение ')
+                                            + os.path.basename(file_name))
+
+    def cancel_file(self):
+        if self.file_jobs:
+            job = max(self.file_jobs)
+            self.files.cancel(job)
+            del self.file_jobs[job]
+            if job == self.open_job:
+                self.open_job = None
+            self.update_file_progress()
+
+    def file_finished(self, job, result):
+        kind, file_name, _ = self.file_jobs.pop(job, (None, None, 0))
+        self.update_file_progress()
+        if job != self.open_job:
+            return
+        self.open_job = None
+        if self.load_start:
+            profiler.stop('load', self.load_start)
+        self.is_draw = False
         self.file_name = file_name
-        try:
-            with open(file_name, 'r') as f:
-                self.is_draw = False
-                self.document = Document(self)
-                self.document.load_file(f)
-                self.document.set_widget(self.widget)
-        except:
-            self.file_name = None
-            QErrorMessage().showMessage('Ошибка чтения файла!')
+        self.set_document(result)
+
+    def file_failed(self, job, error):
+        # отменённая задача уже убрана из file_jobs, её ошибка не показывается
+        if job not in self.file_jobs:
+            return
+        kind = self.file_jobs.pop(job)[0]
+        self.update_file_progress()
+        if kind == 'save':
+            self.show_error('Ошибка сохранения')
+            return
+        if job != self.open_job:
+            return
+        self.open_job = None
+        if isinstance(error, ScriptError):
+            self.show_error(f'Ошибка в скрипте: {error}')
+        else:
+            self.show_error('Ошибка чтения файла!')
+
+    def set_document(self, document):
+        # замена документа в окне одним присваиванием, после чего он показывается
+        self.document = document
+        document.attach()
+        document.set_widget(self.widget)
+        self.update_canvas()
+
+    def show_error(self, text):
+        # окно сообщения держится в self, иначе оно сразу удаляется сборщиком мусора
+        self.error_message = QErrorMessage(self)
+        self.error_message.showMessage(text)
 
     def set_non_animated(self):
         state = not self.nonAnimatedCheckBox.isChecked()
@@ -463,10 +1352,22 @@ class Form(QMainWindow):
             self.sender().setChecked(True)
 
     def select_figure(self):
-        self.document.unset_figures()
-        self.sender().setChecked(True)
-        self.document.select_figure = self.sender().figure
-        self.widget.update()
+        indexes = self.figuresList.selectionModel().selectedIndexes()
+        fig = self.figures_model.figure(indexes[0]) if indexes else None
+        if fig != self.document.select_figure:
+            self.document.set_select_figure(fig)
+            self.widget.update()
+
+    def click_canvas(self, event):
+        # выбор фигуры щелчком по холсту идёт через список фигур
+        fig = self.document.figure_at(event.x(), event.y())
+        selection = self.figuresList.selectionModel()
+        if fig is None:
+            selection.clearSelection()
+            return
+        index = self.figures_model.index(fig.index)
+        selection.setCurrentIndex(index, QItemSelectionModel.ClearAndSelect)
+        self.figuresList.scrollTo(index)
 
     def start(self):
         self.is_draw = True
@@ -475,32 +1376,123 @@ class Form(QMainWindow):
         self.is_draw = False
 
     def speed_up(self):
-        self.speed = self.speed // 2 + 1
-        self.timer.setInterval(self.speed)
+        self.playback.set_speed(self.playback.speed * 2)
+        self.update_fps_label()
 
     def speed_down(self):
-        self.speed *= 2
-        self.timer.setInterval(self.speed)
+        self.playback.set_speed(self.playback.speed // 2)
+        self.update_fps_label()
 
     def prev_step(self):
-        self.document.set_step(self.document.step - 1)
-        self.widget.update()
+        self.document.set_step(math.ceil(self.document.step) - 1)
+        self.update_canvas()
 
     def next_step(self):
-        self.document.set_step(self.document.step + 1)
-        self.widget.update()
+        self.document.set_step(math.floor(self.document.step) + 1)
+        self.update_canvas()
 
     def change_step(self):
-        self.document.set_step(self.slider.value() - 1)
-        self.widget.update()
+        # ползунок двигается и при отрисовке кадра, тогда перерисовывать не нужно
+        scale = self.document.timeline.slider_scale()
+        if self.slider.value() - 1 == self.document.step // scale:
+            return
+        self.document.set_step((self.slider.value() - 1) * scale)
+        self.update_canvas()
+
+    def set_loops(self, index):
+        self.loops = LOOP_CHOICES[index]
+        self.document.set_loops(self.loops)
+        self.update_canvas()
 
     def drawing(self):
+        if profiler.enabled:
+            if self.is_draw:
+                profiler.timer_tick(self.playback.interval)
+            else:
+                profiler.timer_paused()
+        count = self.playback.advance(self.is_draw)
+        if count:
+            self.document.set_step(self.document.step + count)
+            self.update_canvas()
+
+    def update_canvas(self):
+        # перерисовываются только места, где фигуры двигались
+        step = self.document.step
+        self.currentStepLabel.setText(f'Текущий кадр: {int(step) + 1}')
+        self.slider.setValue(int(step // self.document.timeline.slider_scale()) + 1)
+        # надпись замеров поверх холста обновляется целиком
+        region = self.document.dirty_region() if not profiler.enabled else None
+        if region is None:
+            self.widget.update()
+        elif not region.isEmpty():
+            self.widget.update(region)
+
+    def paint_canvas(self, event):
+        region = event.region()
+        if region.contains(self.widget.rect()):
+            region = None
+        self.document.draw(region)
+        self.prefetcher.prefetch(self.document, self.document.prefetch_steps())
+        self.frame_painted()
+
+    def frame_painted(self):
+        # общее для обоих холстов после того, как кадр нарисован
+        if profiler.enabled:
+            profiler.frame_done(self.document.step)
+            self.draw_profile()
         if self.is_draw:
-            self.next_step()
+            if self.playback.frame_painted():
+                self.update_fps_label()
+        else:
+            self.update_fps_label()
+
+    def update_fps_label(self):
+        playback = self.playback
+        frames = self.document.frames
+        self.fpsLabel.setText(f'Скорость: {playback.speed} шаг/с, FPS: {playback.fps:.1f}, '
+                              f'пропущено: {playback.dropped}, кэш кадров: '
+                              f'{frames.hit_rate():.0%}, {len(frames)} шт., '
+                              f'{frames.nbytes / 2 ** 20:.1f} МиБ')
+
+    def draw_profile(self):
+        # средние времена фаз кадра, дрожание таймера и цена фигур по типам
+        lines = profiler.summary()
+        qp = QPainter(self.widget)
+        metrics = qp.fontMetrics()
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 8
+        qp.fillRect(0, 0, width, metrics.height() * len(lines) + 4, QColor(0, 0, 0, 160))
+        qp.setPen(Qt.white)
+        for i, line in enumerate(lines):
+            qp.drawText(4, 2 + metrics.ascent() + i * metrics.height(), line)
+        qp.end()
+
+    def save_profile(self):
+        file_name = QFileDialog.getSaveFileName(self, 'Сохранение замеров', '',
+                                                'Chrome Trace (*.json)')[0]
+        if file_name:
+            try:
+                profiler.save(file_name)
+            except OSError:
+                self.show_error('Ошибка сохранения замеров')
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Space:
             self.is_draw = not self.is_draw
+        elif event.key() == Qt.Key_F3:
+            profiler.set_enabled(not profiler.enabled)
+            self.widget.update()
+        elif event.key() == Qt.Key_F4:
+            self.save_profile()
+        elif event.key() == Qt.Key_Delete and self.document.select_figure is not None:
+            # фигура убирается из сцены без перезагрузки, анимация идёт дальше
+            self.document.remove_figure(self.document.select_figure.index)
+
+    def closeEvent(self, event):
+        # открытие файла бросается, а начатое сохранение дописывается
+        self.cancel_open()
+        self.prefetcher.shutdown()
+        self.files.shutdown()
+        super().closeEvent(event)
 
 
 class VBoxForm(QScrollArea):
@@ -522,28 +1514,121 @@ class VBoxForm(QScrollArea):
                                   - self.v_layout.getContentsMargins()[3])
         self.setWidget(self.widget)
 
+    def update_list(self):
+        # список строится заново, само окно остаётся прежним
+        while self.v_layout.count():
+            self.v_layout.takeAt(0).widget().deleteLater()
+        self.show_list()
 
-class ExamplesForm(VBoxForm):
+
+class CatalogModel(QAbstractListModel):
+    # Скрипты нескольких каталогов одним списком. Картинки читаются с диска,
+    # только когда строка видна, и запоминаются последние THUMBNAIL_CACHE
+    def __init__(self, catalogs, parent=None):
+        super().__init__(parent)
+        self.catalogs = catalogs
+        self.rows = []
+        self.pixmaps = {}
+
+    def update_rows(self):
+        self.beginResetModel()
+        self.rows = [(catalog, name) for catalog in self.catalogs for name in catalog.names]
+        self.pixmaps.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        catalog, name = self.rows[index.row()]
+        entry = catalog.entries.get(name, {})
+        if role == Qt.DisplayRole:
+            return os.path.splitext(name)[0]
+        if role == Qt.ToolTipRole:
+            if 'error' in entry:
+                return f'{name}: {entry["error"]}'
+            if 'figures' not in entry:
+                return name
+            return (f'{catalog.path}{name}\nФигур: {entry["figures"]}, анимаций: {entry["anims"]}\n'
+                    f'Шагов: {entry["duration"]}, холст {entry["width"]}x{entry["height"]}')
+        if role == Qt.DecorationRole and 'figures' in entry:
+            key = catalog.path, name
+            if key not in self.pixmaps:
+                if len(self.pixmaps) >= THUMBNAIL_CACHE:
+                    del self.pixmaps[next(iter(self.pixmaps))]
+                self.pixmaps[key] = QPixmap(catalog.thumbnail(name))
+            return self.pixmaps[key]
+        return None
+
+    def file_name(self, index):
+        catalog, name = self.rows[index.row()]
+        return os.path.join(catalog.path, name)
+
+
+class ExamplesForm(QWidget):
+    # Примеры и буквы с картинками. Список берётся из каталога сразу,
+    # а изменившиеся файлы пересчитываются в фоновом потоке
     def __init__(self, parent_from):
-        super().__init__(parent_from)
+        super().__init__()
+        self.parent_form = parent_from
+        self.catalogs = [Catalog(EXAMPLES_PATH), Catalog(LETTERS_PATH)]
+        self.model = CatalogModel(self.catalogs, self)
+        self.jobs = FileJobs(self)
+        # каталоги, которые сейчас пересчитываются, по номерам задач
+        self.running = {}
+        self.init_ui()
 
     def init_ui(self):
-        self.GEOMETRY = (0, 0, 300, 300)
         self.setWindowTitle('Примеры')
-        super().init_ui()
+        self.resize(640, 480)
+        set_to_screen_center(self)
+        self.list_view = QListView(self)
+        self.list_view.setViewMode(QListView.IconMode)
+        self.list_view.setResizeMode(QListView.Adjust)
+        self.list_view.setMovement(QListView.Static)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setIconSize(QSize(*THUMBNAIL_SIZE))
+        self.list_view.setGridSize(QSize(THUMBNAIL_SIZE[0] + 20, THUMBNAIL_SIZE[1] + 30))
+        self.list_view.setModel(self.model)
+        self.list_view.clicked.connect(self.open_example)
+        self.status_label = QLabel(self)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.list_view)
+        layout.addWidget(self.status_label)
+        self.jobs.progress.connect(self.show_progress)
+        self.jobs.finished.connect(self.catalog_ready)
+        self.jobs.failed.connect(self.catalog_failed)
 
-    def show_list(self):
-        files = os.listdir(EXAMPLES_PATH)
-        examples_name = filter(lambda x: x.endswith('.txt'), files)
-        for name in sorted(examples_name, key=lambda s: int((s.split('.')[0]).split()[1])):
-            btn = QPushButton(name, self.widget)
-            btn.clicked.connect(self.open_example)
-            self.v_layout.addWidget(btn)
-
-    def open_example(self):
-        filename = EXAMPLES_PATH + self.sender().text()
+    def update_list(self):
+        # при каждом показе: новые и изменённые файлы пересчитываются
+        for catalog in self.catalogs:
+            stale = catalog.scan()
+            if stale and catalog not in self.running.values():
+                job = self.jobs.new_job()
+                self.running[job] = catalog
+                self.jobs.start(job, catalog.describe_all, stale, Document, SCRIPT_CACHE)
+        self.model.update_rows()
+        self.status_label.setVisible(bool(self.running))
+
+    def show_progress(self, job, percent):
+        self.status_label.setText(f'Обновление каталога: {percent}%')
+
+    def catalog_ready(self, job, result):
+        catalog, entries = result
+        catalog.merge(entries)
+        del self.running[job]
+        self.model.update_rows()
+        self.status_label.setVisible(bool(self.running))
+
+    def catalog_failed(self, job, error):
+        del self.running[job]
+        self.status_label.setText(f'Ошибка каталога: {error}')
+
+    def open_example(self, index):
         self.close()
-        self.parent_form.open_file(filename)
+        self.parent_form.open_file(self.model.file_name(index))
 
 
 class HistoryForm(VBoxForm):
@@ -575,7 +1660,7 @@ class HistoryForm(VBoxForm):
 class HelpForm(QWidget):
     def __init__(self):
         super().__init__()
-        uic.loadUi('help.ui', self)
+        setup_ui(self, 'help')
         try:
             with open('READ_ME.txt', 'r', encoding='utf-8') as f:
                 self.textEdit.setText(f.read())
@@ -583,6 +1668,13 @@ class HelpForm(QWidget):
             QErrorMessage().showMessage('Ошибка загрузки справки!')
 
 
+def show_window(window):
+    # готовое окно показывается заново и выходит наверх
+    window.show()
+    window.raise_()
+    window.activateWindow()
+
+
 def set_to_screen_center(form):
     desktop = QDesktopWidget()
     rect = desktop.availableGeometry(desktop.primaryScreen())
@@ -595,7 +1687,8 @@ def set_to_screen_center(form):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     QApplication.setStyle(QStyleFactory.create('Fusion'))
-    form = Form()
+    canvas = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in CANVAS_BACKENDS else DEFAULT_CANVAS
+    form = Form(canvas)
     form.setFixedSize(1025, 800)
     form.show()
     form.open_file(EXAMPLES_PATH + 'Пример 1.txt')
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from collections import defaultdict, deque
+
+
+HISTORY_FRAMES = 120  # по скольким последним кадрам считаются средние
+TRACE_EVENTS = 100000  # сколько событий держать для выгрузки трассировки
+FRAME_PHASES = ('evaluate', 'blit', 'paint')
+
+
+class Profiler:
+    # Замеры времени по фазам кадра. Выключенный замер стоит одну проверку
+    # enabled в вызывающем коде, поэтому его можно не убирать из программы
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter_ns()
+        self.reset()
+
+    def reset(self):
+        self.frames = deque(maxlen=HISTORY_FRAMES)
+        self.current = defaultdict(float)
+        self.figures = defaultdict(lambda: [0, 0.0])  # тип фигуры: [штук, мс]
+        self.jitter = deque(maxlen=HISTORY_FRAMES)
+        self.events = deque(maxlen=TRACE_EVENTS)
+        self.tick = None
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.reset()
+
+    def start(self):
+        return time.perf_counter_ns()
+
+    def stop(self, name, start):
+        # фаза name длилась с момента start, время копится до конца кадра
+        end = time.perf_counter_ns()
+        self.current[name] += (end - start) / 1e6
+        self.events.append((name, start, end))
+
+    def timed(self, name, function):
+        # обёртка для вызова рисования фигуры, копит время по типу фигуры
+        figures = self.figures[name]
+
+        def call(*args):
+            start = time.perf_counter_ns()
+            function(*args)
+            figures[0] += 1
+            figures[1] += (time.perf_counter_ns() - start) / 1e6
+        return call
+
+    def timer_tick(self, interval):
+        # отклонение срабатывания таймера от заданного интервала, мс
+        now = time.perf_counter_ns()
+        if self.tick is not None:
+            self.jitter.append((now - self.tick) / 1e6 - interval)
+        self.tick = now
+
+    def timer_paused(self):
+        # пока анимация стоит, срабатывания не меряются: первое после паузы
+        # иначе записало бы всю паузу как опоздание таймера
+        self.tick = None
+
+    def frame_done(self, step):
+        self.current['step'] = step
+        self.frames.append(dict(self.current))
+        self.current.clear()
+
+    def averages(self):
+        frames = list(self.frames)
+        result = {name: sum(frame.get(name, 0) for frame in frames) / len(frames)
+                  for name in FRAME_PHASES} if frames else {}
+        jitter = list(self.jitter)
+        if jitter:
+            result['jitter'] = sum(map(abs, jitter)) / len(jitter)
+            result['jitter_max'] = max(map(abs, jitter))
+        return result
+
+    def summary(self):
+        # строки для надписи поверх холста
+        averages = self.averages()
+        lines = [' '.join(f'{name} {averages[name]:.2f}' for name in FRAME_PHASES
+                          if name in averages) + ' мс/кадр']
+        if 'jitter' in averages:
+            lines.append(f'таймер: ±{averages["jitter"]:.2f} мс, макс. {averages["jitter_max"]:.2f} мс')
+        for name, (count, ms) in sorted(self.figures.items()):
+            if count:
+                lines.append(f'{name}: {ms / count * 1000:.1f} мкс/шт. ({count})')
+        return lines
+
+    def save(self, file_name):
+        # JSON в формате Chrome Trace (chrome://tracing, Perfetto) и сводка
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': 0,
+                   'ts': (start - self.origin) / 1000, 'dur': (end - start) / 1000}
+                  for name, start, end in self.events]
+        summary = {'averages_ms': self.averages(), 'frames': list(self.frames),
+                   'figures': {name: {'count': count, 'ms': ms}
+                               for name, (count, ms) in self.figures.items()}}
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'summary': summary}, f)
+
+
+profiler = Profiler()
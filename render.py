@@ -0,0 +1,255 @@
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtGui import QGuiApplication
+from proekt import Document, DEFAULT_SPEED
+from frames import FrameCache
+from encoders import EncoderThread, PngFrames, open_encoder, is_animated, to_pil
+from glyphs import load_any_script, LOAD_ERRORS
+
+
+# нарисованные кадры для повторов циклов; больше не держится, сколько бы ни было кадров
+EXPORT_CACHE_BYTES = 64 * 2 ** 20
+FILE_INDEX = 100000  # для скольких картинок помнить файл, чтобы копировать повторы циклов
+CHUNK_FRAMES = 64  # кадров в куске при параллельной отрисовке
+CHUNKS_PER_WORKER = 2  # сколько кусков на процесс может быть в работе одновременно
+
+worker_app = None
+worker_document = None
+worker_cache = None
+
+
+class ExportStats:
+    # сколько кадров выгружено, сколько из них пришлось нарисовать и закодировать
+    def __init__(self, frames=0, rendered=0, encoded=0):
+        self.frames = frames
+        self.rendered = rendered
+        self.encoded = encoded
+
+    def add(self, other):
+        self.frames += other.frames
+        self.rendered += other.rendered
+        self.encoded += other.encoded
+
+    @property
+    def skip_ratio(self):
+        # доля кадров, которые не кодировались, а продлили или повторили готовые
+        return 1 - self.encoded / self.frames if self.frames else 0
+
+    def __str__(self):
+        return (f'{self.frames} кадров: нарисовано {self.rendered}, закодировано {self.encoded}, '
+                f'пропущено {self.skip_ratio:.0%}')
+
+
+def load_document(file_name, cache=False):
+    # и обычные скрипты, и буквы в коротком формате, как в окне
+    document = Document()
+    document.load_script(load_any_script(file_name, cache))
+    return document
+
+
+def timeline(document, start=0, end=None, every=1):
+    # с дробным every кадры берутся и между шагами скрипта
+    if end is None or end > document.duration:
+        end = document.duration
+    end = max(end, 1)
+    if every == int(every):
+        return range(start, end, int(every))
+    return [start + i * every for i in range(math.ceil((end - start) / every))]
+
+
+def frame_numbers(steps):
+    # номера кадров в именах файлов: шаги, а для кадров между шагами - номера по порядку
+    return steps if isinstance(steps, range) else range(len(steps))
+
+
+def render_frames(document, steps):
+    for step in steps:
+        yield step, document.render_image(step)
+
+
+def unique_frames(document, steps, numbers, stats, cache=None, files=None):
+    # (номер кадра, картинка, номер кадра-источника) по порядку. Картинка None -
+    # кадр такой же, как предыдущий, или как кадр-источник, если он есть.
+    # Повтор узнаётся до отрисовки по шагу в первом периоде и по матрицам фигур,
+    # а после - сравнением пикселей. files - OrderedDict для выгрузки в отдельные
+    # файлы: где уже лежит картинка шага, чтобы повторы циклов только копировать
+    timeline = document.timeline
+    last_key = last_matrices = last_image = None
+    for number, step in zip(numbers, steps):
+        stats.frames += 1
+        key = timeline.canonical(step)
+        if last_image is not None and key == last_key:
+            yield number, None, None
+            continue
+        if files is not None and key in files:
+            files.move_to_end(key)
+            last_key, last_image = key, None
+            yield number, None, files[key]
+            continue
+        # после копии сравнивать не с чем, следующий другой кадр рисуется
+        matrices = document.frame_state(key)[0]
+        if last_image is not None and np.array_equal(matrices, last_matrices):
+            yield number, None, None
+            continue
+        last_matrices = matrices
+        image = cache.get(key) if cache is not None else None
+        if image is None:
+            image = document.render_image(key)
+            stats.rendered += 1
+            if cache is not None:
+                cache.put(key, image, cache.generation)
+        if image == last_image:
+            yield number, None, None
+            continue
+        last_key, last_image = key, image
+        if files is not None:
+            files[key] = number
+            if len(files) > FILE_INDEX:
+                files.popitem(last=False)
+        yield number, image, None
+
+
+def animated_frame(image, output):
+    # для GIF палитра подбирается заранее, чтобы в параллельном режиме
+    # это делали процессы, а не запись файла
+    frame = to_pil(image)
+    if output.lower().endswith('.gif'):
+        frame = frame.quantize()
+    return frame
+
+
+def export(document, steps, output, frame_duration=40):
+    # PNG-последовательность в папку или анимированный GIF/WebP. Кадры рисуются
+    # здесь и через очередь уходят кодироваться в другой поток; повторы не рисуются
+    # и не кодируются, а продлевают предыдущий кадр. Возвращает ExportStats
+    stats = ExportStats()
+    encoder = open_encoder(output, frame_duration)
+    writer = EncoderThread(encoder)
+    try:
+        files = None if is_animated(output) else OrderedDict()
+        for frame in unique_frames(document, steps, frame_numbers(steps), stats,
+                                   FrameCache(EXPORT_CACHE_BYTES), files):
+            writer.put(*frame)
+    finally:
+        writer.close()
+    stats.encoded = encoder.encoded
+    return stats
+
+
+def init_worker(script):
+    # каждый процесс загружает скрипт один раз
+    global worker_app, worker_document, worker_cache
+    worker_app = QGuiApplication(sys.argv[:1])
+    worker_document = load_document(script)
+    worker_cache = FrameCache(EXPORT_CACHE_BYTES // CHUNKS_PER_WORKER)
+
+
+def render_chunk(task):
+    # PNG-кадры процесс пишет сам, кадры для GIF/WebP возвращает родителю
+    steps, numbers, output, animated = task
+    stats = ExportStats()
+    if animated:
+        frames = unique_frames(worker_document, steps, numbers, stats, worker_cache)
+        result = [image if image is None else animated_frame(image, output)
+                  for number, image, source in frames]
+        return stats, result
+    encoder = PngFrames(output, 0)
+    for frame in unique_frames(worker_document, steps, numbers, stats, worker_cache,
+                               OrderedDict()):
+        encoder.add(*frame)
+    stats.encoded = encoder.encoded
+    return stats, None
+
+
+def export_parallel(script, steps, output, workers, frame_duration=40):
+    # Кадры делятся на куски по порядку. В работе одновременно не больше
+    # CHUNKS_PER_WORKER кусков на процесс, поэтому память не зависит от числа кадров
+    animated = is_animated(output)
+    numbers = frame_numbers(steps)
+    tasks = ((steps[i:i + CHUNK_FRAMES], numbers[i:i + CHUNK_FRAMES], output, animated)
+             for i in range(0, len(steps), CHUNK_FRAMES))
+    stats = ExportStats()
+    encoder = open_encoder(output, frame_duration) if animated else None
+
+    def collect(result):
+        chunk_stats, frames = result.get()
+        stats.add(chunk_stats)
+        if animated:
+            for frame in frames:
+                encoder.add(None, frame, None)
+
+    # spawn, а не fork: Qt в родительском процессе уже может быть запущен
+    context = multiprocessing.get_context('spawn')
+    try:
+        with context.Pool(workers, init_worker, (script,)) as pool:
+            running = deque()
+            for task in tasks:
+                running.append(pool.apply_async(render_chunk, (task,)))
+                if len(running) >= workers * CHUNKS_PER_WORKER:
+                    collect(running.popleft())
+            while running:
+                collect(running.popleft())
+    finally:
+        if encoder is not None:
+            encoder.close()
+    if animated:
+        stats.encoded = encoder.encoded
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Отрисовка скрипта анимации в файлы без окна')
+    parser.add_argument('script', help='скрипт анимации (*.txt)')
+    parser.add_argument('output', help='папка для PNG-кадров или файл .gif/.webp')
+    parser.add_argument('--start', type=int, default=0, help='первый кадр')
+    parser.add_argument('--end', type=int, default=None, help='кадр, перед которым остановиться')
+    parser.add_argument('--every', type=float, default=1,
+                        help='брать каждый N-й кадр (дробное N - кадры и между шагами)')
+    parser.add_argument('--fps', type=float, default=None,
+                        help='кадров в секунду при --speed шагов в секунду, вместо --every')
+    parser.add_argument('--speed', type=float, default=DEFAULT_SPEED,
+                        help='шагов анимации в секунду для --fps')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='сколько раз повторить циклические анимации')
+    parser.add_argument('--frame-duration', type=int, default=None,
+                        help='длительность кадра в GIF/WebP, мс (по умолчанию 40 или 1000 / fps)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов для отрисовки (0 - по числу ядер)')
+    args = parser.parse_args(argv)
+
+    app = QGuiApplication(sys.argv[:1])
+    try:
+        document = load_document(args.script)
+    except LOAD_ERRORS as error:
+        parser.exit(1, f'{error}\n')
+    document.set_loops(max(args.loops, 1))
+    every = args.speed / args.fps if args.fps else args.every
+    if every <= 0:
+        parser.exit(1, 'шаг между кадрами должен быть больше нуля\n')
+    frame_duration = args.frame_duration or (round(1000 / args.fps) if args.fps else 40)
+    steps = timeline(document, args.start, args.end, every)
+    workers = args.workers or os.cpu_count()
+    start = time.perf_counter()
+    try:
+        if workers > 1:
+            stats = export_parallel(args.script, steps, args.output, workers, frame_duration)
+        else:
+            stats = export(document, steps, args.output, frame_duration)
+    except OSError as error:
+        # например, папки для файла выгрузки нет или в неё нельзя писать
+        parser.exit(1, f'{error}\n')
+    elapsed = time.perf_counter() - start
+    print(f'{stats} за {elapsed:.2f} с, {stats.frames / elapsed:.1f} кадров/с')
+
+
+if __name__ == '__main__':
+    main()
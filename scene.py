@@ -0,0 +1,211 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtGui import QTransform
+
+from easing import ease
+
+
+MOVE, ROTATE, SCALE = 0, 1, 2
+STATE_CACHE_BYTES = 64 * 2 ** 20  # сколько памяти отдать под вычисленные состояния сцены
+
+
+class CompiledScene:
+    # Все анимации документа в виде массивов NumPy: преобразования всех
+    # анимированных фигур считаются одним векторным вычислением на шаг.
+    # figures - номера фигур, если нужна сцена только из части анимированных
+    def __init__(self, store, figures=None):
+        self.animated = np.flatnonzero(store.anim_count > 0) if figures is None else figures
+        counts = store.anim_count[self.animated].astype(np.int64)
+        # номера анимаций по порядку фигур и номер каждой внутри своей фигуры
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        orders = np.arange(counts.sum()) - first
+        anims = np.repeat(store.anim_start[self.animated].astype(np.int64), counts) + orders
+        self.center = np.stack([store.x[self.animated], store.y[self.animated]], -1)
+        self.angle = store.angle[self.animated]
+        self.anim_slot = np.repeat(np.arange(len(self.animated)), counts)
+        self.anim_kind = store.anim_kind[anims]
+        self.anim_time = store.anim_time[anims]
+        self.anim_cycle = store.anim_cycle[anims]
+        self.anim_target = np.stack([store.anim_a[anims], store.anim_b[anims]], -1)
+        # анимации с неравномерным ходом, по кривым
+        anim_ease = store.anim_ease[anims]
+        self.eased = [(store.easings[i], np.flatnonzero(anim_ease == i))
+                      for i in np.flatnonzero(np.bincount(anim_ease)).tolist() if i]
+        # Анимации одной фигуры применяются по порядку, поэтому
+        # композиция матриц идёт по «слоям» с одинаковым номером анимации
+        self.layers = [np.flatnonzero(orders == k) for k in range(counts.max(initial=0))]
+        self.local = store.local_bounds(self.animated)
+        # шаг, с которого преобразование фигуры больше не меняется (inf - есть цикл)
+        # (анимации идут подряд по фигурам, у каждой фигуры есть хотя бы одна)
+        self.finish = np.zeros(len(self.animated))
+        if len(self.animated):
+            self.finish[:] = np.maximum.reduceat(self.anim_time, np.cumsum(counts) - counts)
+        self.finish[self.anim_slot[self.anim_cycle]] = np.inf
+
+    def __len__(self):
+        return len(self.animated)
+
+    def shift(self, index, delta):
+        # номера фигур после вставки или удаления неанимированной фигуры на месте index
+        self.animated = np.where(self.animated >= index, self.animated + delta, self.animated)
+
+    def coeffs(self, steps):
+        # Коэффициенты всех анимаций, массив формы (шаги, анимации).
+        # Шаги могут быть дробными: анимация идёт и между шагами скрипта
+        steps = np.asarray(steps, dtype=np.float64).reshape(-1, 1)
+        time = np.maximum(self.anim_time, 1)
+        n, rest = np.divmod(steps, time)
+        forward = rest / time
+        cycle = np.where(n % 2, 1 - forward, forward)
+        once = np.minimum(1, steps / time)
+        coeff = np.where(self.anim_cycle, cycle, once)
+        for curve, anims in self.eased:
+            coeff[:, anims] = ease(curve, coeff[:, anims])
+        coeff[:, self.anim_time <= 0] = 1
+        return coeff
+
+    def transforms(self, steps):
+        # Аффинные матрицы 2x3 анимированных фигур, форма (шаги, фигуры, 2, 3);
+        # для одного шага первая ось отбрасывается.
+        # Анимации применяются так же, как вызовы translate/rotate/scale у QPainter
+        single = np.ndim(steps) == 0
+        coeff = self.coeffs(steps)
+        shape = (coeff.shape[0], len(self))
+        a, b, tx = np.ones(shape), np.zeros(shape), np.tile(self.center[:, 0], (shape[0], 1))
+        c, d, ty = np.zeros(shape), np.ones(shape), np.tile(self.center[:, 1], (shape[0], 1))
+        for layer in self.layers:
+            for kind in (MOVE, ROTATE, SCALE):
+                anims = layer[self.anim_kind[layer] == kind]
+                if not anims.size:
+                    continue
+                slots = self.anim_slot[anims]
+                k = coeff[:, anims]
+                ma, mb, mc, md = a[:, slots], b[:, slots], c[:, slots], d[:, slots]
+                if kind == MOVE:
+                    u = (self.anim_target[anims, 0] - self.center[slots, 0]) * k
+                    v = (self.anim_target[anims, 1] - self.center[slots, 1]) * k
+                    tx[:, slots] += ma * u + mb * v
+                    ty[:, slots] += mc * u + md * v
+                elif kind == ROTATE:
+                    angle = np.radians(self.angle[slots] + self.anim_target[anims, 0] * k)
+                    cos, sin = np.cos(angle), np.sin(angle)
+                    a[:, slots] = ma * cos + mb * sin
+                    b[:, slots] = mb * cos - ma * sin
+                    c[:, slots] = mc * cos + md * sin
+                    d[:, slots] = md * cos - mc * sin
+                else:
+                    factor = self.anim_target[anims, 0] * k
+                    a[:, slots] = ma * factor
+                    b[:, slots] = mb * factor
+                    c[:, slots] = mc * factor
+                    d[:, slots] = md * factor
+        result = np.stack([np.stack([a, b, tx], -1), np.stack([c, d, ty], -1)], -2)
+        return result[0] if single else result
+
+    def bounds(self, matrices, slots=None):
+        # Границы фигур на холсте (x0, y0, x1, y1) по их матрицам, с запасом на перо
+        local = self.local if slots is None else self.local[slots]
+        xs = local[:, [0, 2, 2, 0]]
+        ys = local[:, [1, 1, 3, 3]]
+        m = matrices[..., None]
+        x = m[:, 0, 0] * xs + m[:, 0, 1] * ys + m[:, 0, 2]
+        y = m[:, 1, 0] * xs + m[:, 1, 1] * ys + m[:, 1, 2]
+        pen = 1 + np.maximum(np.abs(m[:, 0, 0]) + np.abs(m[:, 0, 1]),
+                             np.abs(m[:, 1, 0]) + np.abs(m[:, 1, 1]))[:, 0]
+        return np.stack([x.min(1) - pen, y.min(1) - pen, x.max(1) + pen, y.max(1) + pen], -1)
+
+
+def to_qtransform(m):
+    return QTransform(m[0, 0], m[1, 0], m[0, 1], m[1, 1], m[0, 2], m[1, 2])
+
+
+class StateCache:
+    # Матрицы и границы анимированных фигур по моменту времени: одно вычисление
+    # делят отрисовка, поиск фигуры под точкой, фоновые кадры и выгрузка.
+    # Фигуры без циклов после конца своих анимаций не меняются, поэтому их
+    # состояние считается один раз, а дальше пересчитываются только фигуры с циклами.
+    # Обращения бывают и из фонового потока, поэтому словарь под замком
+    def __init__(self, store, scene, budget=STATE_CACHE_BYTES):
+        self.scene = scene
+        self.budget = budget
+        self.states = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        looping = np.isinf(scene.finish)
+        # с этого момента двигаются только фигуры с циклами
+        self.settle = scene.finish[~looping].max(initial=0)
+        self.looping = np.flatnonzero(looping)
+        self.loop_scene = CompiledScene(store, scene.animated[self.looping])
+        self.final = None
+
+    def splice(self, store, scene, slot, removed, added):
+        # Кэш для сцены, в которой на месте slot убрана или добавлена одна фигура
+        # (или заменена, если и то и другое): сохранённые состояния переносятся,
+        # и в них считаются только строки этой фигуры
+        cache = StateCache(store, scene, self.budget)
+        cache.hits, cache.misses = self.hits, self.misses
+        with self.lock:
+            states = list(self.states.items())
+        if not states:
+            return cache
+        part = CompiledScene(store, scene.animated[slot:slot + added])
+        rows = part.transforms(np.array([time for time, state in states], dtype=np.float64))
+        for (time, (matrices, bounds)), moving in zip(states, rows):
+            matrices = np.concatenate([matrices[:slot], moving, matrices[slot + removed:]])
+            bounds = np.concatenate([bounds[:slot], part.bounds(moving), bounds[slot + removed:]])
+            matrices.flags.writeable = False
+            bounds.flags.writeable = False
+            cache.put(time, (matrices, bounds))
+        return cache
+
+    def get(self, time):
+        with self.lock:
+            state = self.states.get(time)
+            if state is None:
+                self.misses += 1
+                return None
+            self.states.move_to_end(time)
+            self.hits += 1
+            return state
+
+    def put(self, time, state):
+        size = state[0].nbytes + state[1].nbytes
+        with self.lock:
+            if time in self.states:
+                return
+            self.states[time] = state
+            self.nbytes += size
+            # последнее состояние остаётся, даже если оно одно больше бюджета
+            while self.nbytes > self.budget and len(self.states) > 1:
+                _, (matrices, bounds) = self.states.popitem(last=False)
+                self.nbytes -= matrices.nbytes + bounds.nbytes
+
+    def evaluate(self, time):
+        scene = self.scene
+        if time < self.settle or len(self.looping) == len(scene):
+            matrices = scene.transforms(time)
+            bounds = scene.bounds(matrices)
+        else:
+            if self.final is None:
+                final = scene.transforms(self.settle)
+                self.final = (final, scene.bounds(final))
+            matrices, bounds = self.final[0].copy(), self.final[1].copy()
+            if len(self.looping):
+                moving = self.loop_scene.transforms(time)
+                matrices[self.looping] = moving
+                bounds[self.looping] = self.loop_scene.bounds(moving)
+        # состояние общее для всех, кто его получил, поэтому только для чтения
+        matrices.flags.writeable = False
+        bounds.flags.writeable = False
+        return matrices, bounds
+
+    def state(self, time):
+        state = self.get(time)
+        if state is None:
+            state = self.evaluate(time)
+            self.put(time, state)
+        return state
@@ -0,0 +1,336 @@
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from easing import LINEAR, is_easing, control_points
+
+
+FIGURE_NAMES = ('rectangle', 'circle', 'triangle')
+ANIM_NAMES = ('move', 'rotate', 'scale')
+FIGURE_KINDS = {name: kind for kind, name in enumerate(FIGURE_NAMES)}
+ANIM_KINDS = {name: kind for kind, name in enumerate(ANIM_NAMES)}
+# число чисел после имени фигуры / анимации (без цвета и признака цикла)
+FIGURE_ARGS = {'rectangle': 5, 'circle': 3, 'triangle': 4}
+ANIM_ARGS = {'move': 3, 'rotate': 2, 'scale': 2}
+
+# одна фигура: тип, центр, размеры, угол, номер цвета в палитре и её анимации
+FIGURE_DTYPE = np.dtype([('kind', 'u1'), ('x', '<f8'), ('y', '<f8'), ('width', '<f8'),
+                         ('height', '<f8'), ('angle', '<f8'), ('color', '<u4'),
+                         ('anim_start', '<u4'), ('anim_count', '<u4')])
+# ease - номер кривой в таблице кривых скрипта, 0 - равномерно
+ANIM_DTYPE = np.dtype([('kind', 'u1'), ('a', '<f8'), ('b', '<f8'), ('time', '<i8'),
+                       ('cycle', 'u1'), ('ease', '<u2')])
+
+CACHE_SUFFIX = '.anim.bin'
+CACHE_MAGIC = b'ANIM'
+CACHE_VERSION = 2
+# сигнатура, версия, mtime и размер исходного .txt, холст, число фигур,
+# анимаций, длина палитры и таблицы кривых в байтах
+CACHE_HEADER = struct.Struct('<4sIqqiiIIII')
+PROGRESS_FIGURES = 5000  # через сколько фигур разбор сообщает о ходе работы
+
+
+class ScriptError(Exception):
+    def __init__(self, message, line=None, file_name=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+        self.file_name = file_name
+
+    def __str__(self):
+        place = []
+        if self.file_name:
+            place.append(os.path.basename(self.file_name))
+        if self.line:
+            place.append(f'строка {self.line}')
+        return ': '.join(place + [self.message])
+
+
+class Script:
+    # Разобранный скрипт анимации: размер холста, таблицы фигур и анимаций,
+    # палитра и кривые анимаций (первая всегда linear)
+    def __init__(self, width, height, figures, anims, colors, easings=None):
+        self.width = width
+        self.height = height
+        self.figures = figures
+        self.anims = anims
+        self.colors = colors
+        self.easings = easings or [LINEAR]
+
+
+class Lines:
+    def __init__(self, text):
+        self.lines = text.splitlines()
+        self.number = 0
+
+    def next(self, what):
+        # следующая непустая строка, разбитая на слова
+        while self.number < len(self.lines):
+            self.number += 1
+            tokens = self.lines[self.number - 1].split()
+            if tokens:
+                return tokens
+        raise ScriptError(f'файл закончился, ожидалась {what}', self.number + 1)
+
+    def error(self, message):
+        return ScriptError(message, self.number)
+
+    def numbers(self, tokens, count, what):
+        if len(tokens) != count:
+            raise self.error(f'{what}: ожидалось чисел: {count}, получено: {len(tokens)}')
+        try:
+            return [float(x) for x in tokens]
+        except ValueError:
+            raise self.error(f'{what}: неверное число в «{" ".join(tokens)}»') from None
+
+    def integer(self, what):
+        tokens = self.next(what)
+        if len(tokens) != 1 or not tokens[0].isdigit():
+            raise self.error(f'ожидалась {what}, получено «{" ".join(tokens)}»')
+        return int(tokens[0])
+
+
+def parse_script(text, progress=None):
+    # Быстрый разбор без проверок, а при любой ошибке - построчный разбор,
+    # который сообщает номер строки с ошибкой. progress(доля) вызывается
+    # по ходу разбора и может прервать его своим исключением
+    try:
+        return parse_bulk(text, progress)
+    except (ValueError, IndexError, KeyError):
+        return parse_checked(text, progress)
+
+
+def parse_bulk(text, progress=None):
+    # Строки только раскладываются по спискам, а числа переводятся
+    # из текста разом, средствами NumPy
+    lines = text.splitlines()
+    width, height = lines[0].split()
+    count = int(lines[1])
+    if count < 0:
+        raise ValueError(count)
+    kinds, numbers, color_names, anim_counts = [], [], [], []
+    anim_kinds, anim_numbers, anim_cycles, anim_eases = [], [], [], []
+    easings = {LINEAR: 0}
+    n = 2
+    for i in range(count):
+        if progress and i % PROGRESS_FIGURES == 0:
+            progress(i / count)
+        name, *args = lines[n].split()
+        kind = FIGURE_KINDS[name]
+        if len(args) != FIGURE_ARGS[name] + 1:
+            raise ValueError(name)
+        # у всех фигур пять чисел: x, y, ширина, высота, угол
+        if kind == 0:
+            numbers += args[:5]
+        elif kind == 1:
+            numbers += args[:3]
+            numbers += ('0', '0')
+        else:
+            numbers += args[:3]
+            numbers += ('0', args[3])
+        kinds.append(kind)
+        color_names.append(args[-1])
+        anim_count = int(lines[n + 1])
+        if anim_count < 0:
+            raise ValueError(anim_count)
+        anim_counts.append(anim_count)
+        n += 2
+        for line in lines[n:n + anim_count]:
+            name, *args = line.split()
+            kind = ANIM_KINDS[name]
+            size = ANIM_ARGS[name]
+            if not size <= len(args) <= size + 2:
+                raise ValueError(name)
+            # у всех анимаций три числа: две цели и время
+            if kind == 0:
+                anim_numbers += args[:3]
+            else:
+                anim_numbers += (args[0], '0', args[1])
+            anim_kinds.append(kind)
+            cycle, ease = False, None
+            # после чисел в любом порядке cycle и кривая
+            for word in args[size:]:
+                if word == 'cycle' and not cycle:
+                    cycle = True
+                elif ease is None:
+                    ease = easings.setdefault(word, len(easings))
+                else:
+                    raise ValueError(word)
+            anim_cycles.append(cycle)
+            anim_eases.append(ease or 0)
+        n += anim_count
+        if n > len(lines):
+            raise IndexError(n)
+    for word in list(easings)[1:]:
+        control_points(word)
+
+    palette = {}
+    figures = np.zeros(count, dtype=FIGURE_DTYPE)
+    figures['kind'] = kinds
+    values = np.array(numbers, dtype=np.float64).reshape(-1, 5)
+    for i, field in enumerate(('x', 'y', 'width', 'height', 'angle')):
+        figures[field] = values[:, i]
+    figures['color'] = [palette.setdefault(name, len(palette)) for name in color_names]
+    figures['anim_count'] = anim_counts
+    figures['anim_start'] = np.cumsum(anim_counts) - anim_counts
+
+    anims = np.zeros(len(anim_kinds), dtype=ANIM_DTYPE)
+    anims['kind'] = anim_kinds
+    values = np.array(anim_numbers, dtype=np.float64).reshape(-1, 3)
+    anims['a'] = values[:, 0]
+    anims['b'] = values[:, 1]
+    anims['time'] = values[:, 2]
+    anims['cycle'] = anim_cycles
+    anims['ease'] = anim_eases
+    return Script(int(width), int(height), figures, anims, list(palette), list(easings))
+
+
+def parse_checked(text, progress=None):
+    lines = Lines(text)
+    size = lines.next('строка с размером холста')
+    width, height = lines.numbers(size, 2, 'размер холста')
+    figure_count = lines.integer('строка с числом фигур')
+    figure_rows = []
+    anim_rows = []
+    colors = {}
+    easings = {LINEAR: 0}
+    for i in range(figure_count):
+        if progress and i % PROGRESS_FIGURES == 0:
+            progress(i / figure_count)
+        name, *args = lines.next(f'фигура {i + 1}')
+        if name not in FIGURE_ARGS:
+            raise lines.error(f'неизвестная фигура «{name}»')
+        if not args:
+            raise lines.error(f'{name}: не указан цвет')
+        values = lines.numbers(args[:-1], FIGURE_ARGS[name], name)
+        if name == 'rectangle':
+            x, y, width_, height_, angle = values
+        elif name == 'circle':
+            (x, y, width_), height_, angle = values, 0, 0
+        else:
+            (x, y, width_, angle), height_ = values, 0
+        color = colors.setdefault(args[-1], len(colors))
+        anim_count = lines.integer(f'строка с числом анимаций фигуры {i + 1}')
+        figure_rows.append((FIGURE_NAMES.index(name), x, y, width_, height_, angle, color,
+                            len(anim_rows), anim_count))
+        for j in range(anim_count):
+            anim_name, *args = lines.next(f'анимация {j + 1} фигуры {i + 1}')
+            if anim_name not in ANIM_ARGS:
+                raise lines.error(f'неизвестная анимация «{anim_name}»')
+            count = ANIM_ARGS[anim_name]
+            if len(args) > count + 2:
+                raise lines.error(f'{anim_name}: лишние слова «{" ".join(args[count + 2:])}»')
+            values = lines.numbers(args[:count], count, anim_name)
+            *targets, time = values
+            if len(targets) == 1:
+                targets.append(0)
+            cycle, ease = False, None
+            for word in args[count:]:
+                if word == 'cycle' and not cycle:
+                    cycle = True
+                elif ease is None and is_easing(word):
+                    if word != LINEAR:
+                        try:
+                            control_points(word)
+                        except ValueError as error:
+                            raise lines.error(str(error)) from None
+                    ease = easings.setdefault(word, len(easings))
+                else:
+                    raise lines.error(f'{anim_name}: ожидались cycle или кривая, получено «{word}»')
+            anim_rows.append((ANIM_NAMES.index(anim_name), *targets, int(time), cycle, ease or 0))
+    figures = np.array(figure_rows, dtype=FIGURE_DTYPE)
+    anims = np.array(anim_rows, dtype=ANIM_DTYPE)
+    return Script(int(width), int(height), figures, anims, list(colors), list(easings))
+
+
+def cache_name(file_name):
+    return os.path.splitext(file_name)[0] + CACHE_SUFFIX
+
+
+def save_cache(script, file_name):
+    stat = os.stat(file_name)
+    colors = '\n'.join(script.colors).encode('utf-8')
+    easings = '\n'.join(script.easings).encode('utf-8')
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, stat.st_mtime_ns, stat.st_size,
+                               script.width, script.height, len(script.figures),
+                               len(script.anims), len(colors), len(easings))
+    # Пишется во временный файл рядом и подменяет кэш целиком: скрипт может
+    # одновременно открываться в окне и описываться для каталога примеров,
+    # и читающий не должен увидеть наполовину записанный кэш
+    target = cache_name(file_name)
+    handle, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(target) + '.',
+                                    dir=os.path.dirname(target) or '.')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(header)
+            f.write(script.figures.tobytes())
+            f.write(script.anims.tobytes())
+            f.write(colors)
+            f.write(easings)
+        os.replace(temp, target)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def load_cache(file_name):
+    # None, если кэша нет или он не соответствует текущему .txt
+    try:
+        stat = os.stat(file_name)
+        with open(cache_name(file_name), 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(data) < CACHE_HEADER.size:
+        return None
+    magic, version, mtime, size, width, height, figure_count, anim_count, colors_size, \
+        easings_size = CACHE_HEADER.unpack_from(data)
+    if (magic, version, mtime, size) != (CACHE_MAGIC, CACHE_VERSION, stat.st_mtime_ns,
+                                         stat.st_size):
+        return None
+    # обрезанный или испорченный кэш - тоже промах, тогда он перепишется из .txt
+    if len(data) != CACHE_HEADER.size + figure_count * FIGURE_DTYPE.itemsize + \
+            anim_count * ANIM_DTYPE.itemsize + colors_size + easings_size:
+        return None
+    offset = CACHE_HEADER.size
+    figures = np.frombuffer(data, FIGURE_DTYPE, figure_count, offset)
+    offset += figures.nbytes
+    anims = np.frombuffer(data, ANIM_DTYPE, anim_count, offset)
+    offset += anims.nbytes
+    try:
+        colors = data[offset:offset + colors_size].decode('utf-8').split('\n') \
+            if colors_size else []
+        offset += colors_size
+        easings = data[offset:offset + easings_size].decode('utf-8').split('\n')
+    except UnicodeDecodeError:
+        return None
+    if easings[0] != LINEAR:
+        return None
+    return Script(width, height, figures, anims, colors, easings)
+
+
+def load_script(file_name, cache=False, progress=None):
+    # с cache=True рядом со скриптом хранится его двоичная копия *.anim.bin
+    if cache:
+        script = load_cache(file_name)
+        if script is not None:
+            return script
+    with open(file_name, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        script = parse_script(text, progress)
+    except ScriptError as error:
+        error.file_name = file_name
+        raise
+    if cache:
+        try:
+            save_cache(script, file_name)
+        except OSError:
+            pass
+    return script
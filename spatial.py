@@ -0,0 +1,90 @@
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QRegion
+
+
+CELL_SIZE = 64  # клетка сетки для поиска фигур, пикселей
+DIRTY_CELL_SIZE = 16  # точность области перерисовки, пикселей
+# если перерисовать надо больше этой доли холста, проще перерисовать весь
+FULL_UPDATE_SHARE = 0.5
+
+
+class SpatialGrid:
+    # Равномерная сетка над холстом: для каждой клетки хранятся номера
+    # прямоугольников (x0, y0, x1, y1), которые её задевают.
+    # Всё, что выходит за холст, попадает в крайние клетки
+    def __init__(self, boxes, width, height, cell=CELL_SIZE):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.cell = cell
+        self.cols = max(1, -(-int(width) // cell))
+        self.rows = max(1, -(-int(height) // cell))
+        x0, y0, x1, y1 = self.cell_ranges(self.boxes)
+        spans = x1 - x0 + 1
+        counts = spans * (y1 - y0 + 1)
+        items = np.repeat(np.arange(len(self.boxes)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (y0[items] + k // spans[items]) * self.cols + x0[items] + k % spans[items]
+        order = np.argsort(cells, kind='stable')
+        self.items = items[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.rows * self.cols + 1))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def cell_ranges(self, boxes):
+        cells = np.floor(boxes / self.cell).astype(np.int64)
+        x0 = np.clip(cells[:, 0], 0, self.cols - 1)
+        y0 = np.clip(cells[:, 1], 0, self.rows - 1)
+        x1 = np.clip(cells[:, 2], x0, self.cols - 1)
+        y1 = np.clip(cells[:, 3], y0, self.rows - 1)
+        return x0, y0, x1, y1
+
+    def query(self, x0, y0, x1, y1):
+        # номера прямоугольников, пересекающих заданный, по возрастанию
+        (cx0,), (cy0,), (cx1,), (cy1,) = self.cell_ranges(np.array([[x0, y0, x1, y1]]))
+        parts = [self.items[self.starts[row + cx0]:self.starts[row + cx1 + 1]]
+                 for row in range(cy0 * self.cols, (cy1 + 1) * self.cols, self.cols)]
+        found = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+        boxes = self.boxes[found]
+        hit = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+        return found[hit]
+
+    def query_region(self, region):
+        rects = region.rects()
+        if not rects:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.query(r.left(), r.top(), r.right() + 1, r.bottom() + 1)
+                                         for r in rects]))
+
+    def query_point(self, x, y):
+        return self.query(x, y, x, y)
+
+
+def region_from_boxes(boxes, width, height, cell=DIRTY_CELL_SIZE):
+    # Объединение прямоугольников, огрублённое до клеток сетки: так в QRegion
+    # попадает не больше одного прямоугольника на отрезок клеток в строке.
+    # None - перерисовать всё
+    cols, rows = -(-int(width) // cell), -(-int(height) // cell)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    cells = np.floor(boxes / cell).astype(np.int64)
+    inside = (cells[:, 2] >= 0) & (cells[:, 3] >= 0) & (cells[:, 0] < cols) & (cells[:, 1] < rows)
+    cells = cells[inside]
+    x0 = np.clip(cells[:, 0], 0, cols - 1)
+    y0 = np.clip(cells[:, 1], 0, rows - 1)
+    x1 = np.clip(cells[:, 2], 0, cols - 1) + 1
+    y1 = np.clip(cells[:, 3], 0, rows - 1) + 1
+    # покрытие клеток через двумерные разности и накопленные суммы
+    diff = np.zeros((rows + 1) * (cols + 1), dtype=np.int64)
+    for ys, xs, sign in ((y0, x0, 1), (y0, x1, -1), (y1, x0, -1), (y1, x1, 1)):
+        diff += sign * np.bincount(ys * (cols + 1) + xs, minlength=len(diff))
+    covered = diff.reshape(rows + 1, cols + 1).cumsum(0).cumsum(1)[:rows, :cols] > 0
+    if covered.mean() > FULL_UPDATE_SHARE:
+        return None
+    # отрезки закрашенных клеток в строках, концы идут в том же порядке, что и начала
+    edges = np.diff(np.pad(covered.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    region = QRegion()
+    region.setRects([QRect(start * cell, row * cell, (end - start) * cell, cell)
+                     for row, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist())])
+    return region
@@ -0,0 +1,147 @@
+import numpy as np
+from PyQt5.QtGui import QColor, QBrush, QPen
+
+from easing import LINEAR, control_points
+from script_parser import FIGURE_DTYPE, ANIM_DTYPE
+
+
+# столбцы одной фигуры и одной анимации, без положения анимаций фигуры в таблице
+FIGURE_COLUMNS = ('kind', 'x', 'y', 'width', 'height', 'angle', 'color')
+ANIM_COLUMNS = ('anim_kind', 'anim_a', 'anim_b', 'anim_time', 'anim_cycle', 'anim_ease')
+
+
+class FigureStore:
+    # Фигуры и анимации документа по столбцам: типизированные массивы вместо
+    # отдельных объектов и общая палитра заранее созданных кистей и перьев
+    def __init__(self, script=None):
+        figures = script.figures if script else np.zeros(0, dtype=FIGURE_DTYPE)
+        anims = script.anims if script else np.zeros(0, dtype=ANIM_DTYPE)
+        self.kind = np.array(figures['kind'], dtype=np.uint8)
+        self.x = np.array(figures['x'], dtype=np.float64)
+        self.y = np.array(figures['y'], dtype=np.float64)
+        self.width = np.array(figures['width'], dtype=np.float64)
+        self.height = np.array(figures['height'], dtype=np.float64)
+        self.angle = np.array(figures['angle'], dtype=np.float64)
+        self.color = np.array(figures['color'], dtype=np.uint32)
+        self.anim_start = np.array(figures['anim_start'], dtype=np.uint32)
+        self.anim_count = np.array(figures['anim_count'], dtype=np.uint32)
+
+        self.anim_kind = np.array(anims['kind'], dtype=np.uint8)
+        self.anim_a = np.array(anims['a'], dtype=np.float64)
+        self.anim_b = np.array(anims['b'], dtype=np.float64)
+        self.anim_time = np.array(anims['time'], dtype=np.int64)
+        self.anim_cycle = np.array(anims['cycle'], dtype=bool)
+        self.anim_ease = np.array(anims['ease'], dtype=np.uint16)
+        self.easings = list(script.easings) if script else [LINEAR]
+
+        self.palette = []
+        self.qcolors, self.brushes, self.pens, self.selected_brushes = [], [], [], []
+        for name in (script.colors if script else []):
+            self.add_color(name)
+
+    def add_color(self, name):
+        color = QColor(name)
+        self.palette.append(name)
+        self.qcolors.append(color)
+        self.brushes.append(QBrush(color))
+        self.pens.append(QPen(color))
+        # выделенная фигура закрашивается обратным цветом
+        self.selected_brushes.append(QBrush(QColor(255 - color.red(), 255 - color.green(),
+                                                   255 - color.blue())))
+
+    def color_index(self, name):
+        # номер цвета в палитре, новый цвет дописывается в конец
+        if name not in self.palette:
+            self.add_color(name)
+        return self.palette.index(name)
+
+    def easing_index(self, word):
+        if word not in self.easings:
+            if word != LINEAR:
+                control_points(word)
+            self.easings.append(word)
+        return self.easings.index(word)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def local_bounds(self, figures=None):
+        # границы фигур в их собственных координатах (x0, y0, x1, y1), как их рисует draw_shape;
+        # figures - номера фигур, если нужны не все
+        figures = slice(None) if figures is None else figures
+        kind, width, height = self.kind[figures], self.width[figures], self.height[figures]
+        x0, y0 = -width / 2, -height / 2
+        x1, y1 = width / 2, height / 2
+        circle = kind == 1
+        x0[circle], y0[circle] = 0, 0
+        x1[circle], y1[circle] = width[circle], width[circle]
+        triangle = kind == 2
+        half = width[triangle] * np.sqrt(3) / 2
+        x0[triangle], y0[triangle] = -half, -width[triangle]
+        x1[triangle], y1[triangle] = half, width[triangle] / 2
+        return np.stack([np.minimum(x0, x1), np.minimum(y0, y1),
+                         np.maximum(x0, x1), np.maximum(y0, y1)], -1)
+
+    def anims(self, index):
+        start = int(self.anim_start[index])
+        return slice(start, start + int(self.anim_count[index]))
+
+    # Правка по одной фигуре или анимации. Вставка и удаление создают новые
+    # массивы, а не меняют старые: их может ещё читать фоновый поток
+
+    def insert_figure(self, index, kind, x, y, width, height, angle, color):
+        start = int(self.anim_start[index]) if index < len(self) else len(self.anim_kind)
+        values = (kind, x, y, width, height, angle, self.color_index(color))
+        for name, value in zip(FIGURE_COLUMNS, values):
+            setattr(self, name, np.insert(getattr(self, name), index, value))
+        self.anim_start = np.insert(self.anim_start, index, start)
+        self.anim_count = np.insert(self.anim_count, index, 0)
+
+    def remove_figure(self, index):
+        # вместе с анимациями фигуры; возвращает их длины и признаки цикла
+        anims = self.anims(index)
+        removed = self.anim_time[anims].copy(), self.anim_cycle[anims].copy()
+        for name in ANIM_COLUMNS:
+            setattr(self, name, np.delete(getattr(self, name), anims))
+        for name in FIGURE_COLUMNS + ('anim_start', 'anim_count'):
+            setattr(self, name, np.delete(getattr(self, name), index))
+        self.anim_start[index:] -= anims.stop - anims.start
+        return removed
+
+    def set_figure(self, index, **values):
+        if 'color' in values:
+            values['color'] = self.color_index(values['color'])
+        for name, value in values.items():
+            getattr(self, name)[index] = value
+
+    def insert_anim(self, figure, position, kind, a, b, time, cycle, ease):
+        row = int(self.anim_start[figure]) + position
+        values = (kind, a, b, time, cycle, self.easing_index(ease))
+        for name, value in zip(ANIM_COLUMNS, values):
+            setattr(self, name, np.insert(getattr(self, name), row, value))
+        self.anim_count = self.anim_count.copy()
+        self.anim_count[figure] += 1
+        self.anim_start = self.anim_start.copy()
+        self.anim_start[figure + 1:] += 1
+
+    def remove_anim(self, figure, position):
+        # возвращает длину и признак цикла удалённой анимации
+        row = int(self.anim_start[figure]) + position
+        removed = self.anim_time[row:row + 1].copy(), self.anim_cycle[row:row + 1].copy()
+        for name in ANIM_COLUMNS:
+            setattr(self, name, np.delete(getattr(self, name), row))
+        self.anim_count = self.anim_count.copy()
+        self.anim_count[figure] -= 1
+        self.anim_start = self.anim_start.copy()
+        self.anim_start[figure + 1:] -= 1
+        return removed
+
+    def set_anim(self, figure, position, **values):
+        row = int(self.anim_start[figure]) + position
+        if 'ease' in values:
+            values['ease'] = self.easing_index(values['ease'])
+        for name, value in values.items():
+            getattr(self, 'anim_' + name)[row] = value
+
+    def nbytes(self):
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
@@ -0,0 +1,77 @@
+import math
+from collections import Counter
+
+import numpy as np
+
+
+SLIDER_MAX = 2 ** 31 - 1  # больше QSlider не вмещает
+LOOP_CHOICES = (1, 2, 5, 10, None)  # None - повторять без конца
+
+
+class Timeline:
+    # Шкала времени документа: сначала вступление, пока идут нециклические
+    # анимации, дальше всё повторяется с периодом, равным НОК длин циклов.
+    # Любой шаг после вступления сводится к шагу внутри первого периода
+    def __init__(self, store, loops=1):
+        # сколько анимаций каждой длины: при правке анимаций счётчики
+        # меняются, и шкала не пересчитывается по всем анимациям заново
+        self.once = Counter()
+        self.periods = Counter()
+        self.loops = loops
+        self.add(store.anim_time, store.anim_cycle)
+
+    def add(self, times, cycles, sign=1):
+        times = np.asarray(times, dtype=np.int64)
+        cycles = np.asarray(cycles, dtype=bool)
+        # циклическая анимация с нулевым временем сразу стоит в конце и не повторяется;
+        # цикл туда и обратно занимает два времени анимации
+        for counter, values in ((self.once, times[~cycles]),
+                                (self.periods, times[cycles & (times > 0)] * 2)):
+            keys, counts = np.unique(values, return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                counter[key] += sign * count
+                if counter[key] <= 0:
+                    del counter[key]
+        self.intro = max([0, *self.once])
+        self.cycles = sorted(self.periods)
+        self.period = math.lcm(*self.cycles) if self.cycles else 0
+
+    def remove(self, times, cycles):
+        self.add(times, cycles, -1)
+
+    @property
+    def cyclic(self):
+        return self.period > 0
+
+    @property
+    def distinct(self):
+        # число разных кадров: вступление и один период
+        return self.intro + (self.period if self.cyclic else 1)
+
+    @property
+    def duration(self):
+        # сколько шагов показывает ползунок и выгружается по умолчанию;
+        # при бесконечном повторе - вступление и один период
+        if not self.cyclic:
+            return self.intro + 1
+        if self.loops is None:
+            return self.distinct
+        return self.intro + self.loops * self.period
+
+    def canonical(self, step):
+        # шаг с тем же кадром внутри вступления и первого периода
+        if step < self.intro:
+            return step
+        if not self.cyclic:
+            return self.intro
+        return self.intro + (step - self.intro) % self.period
+
+    def wrap(self, step):
+        # шаг при бесконечном повторе: счётчик не растёт дальше одного периода
+        if self.loops is None and self.cyclic:
+            return self.canonical(step)
+        return step
+
+    def slider_scale(self):
+        # сколько шагов приходится на одно деление ползунка
+        return -(-self.duration // SLIDER_MAX)